@@ -2,9 +2,22 @@
 # Uses the NetworkX library for maximally weighted matching
 import pandas as pd
 import networkx as nx
+import numpy as np
 import random
-import copy
 import json
+import sys
+import os
+import io
+import hashlib
+import pickle
+import urllib.request
+import urllib.error
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
+from collections import OrderedDict
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+import time
 
 def parseConfig(configFileName):
     '''
@@ -16,13 +29,412 @@ def parseConfig(configFileName):
 
     return config
 
+class FixtureError(Exception):
+    '''
+    Raised when no fixture can be found that meets the requirements, such as
+    the number of rematches allowed
+    '''
+    pass
+
+def getRng(rng = None) -> random.Random:
+    '''
+    Returns a random generator. rng can be a random.Random (returned as is),
+    an int seed, or None for an unseeded generator. Pass the same seed to get
+    the same fixtures from the same inputs.
+    '''
+    if isinstance(rng, random.Random):
+        return rng
+    return random.Random(rng)
+
+class Instrumentation:
+    '''
+    Records the wall time spent in each stage of a run (download, parse,
+    elo replay, graph build, matching and retry) and counts of events such as
+    retries, edges evaluated and history lookups.
+    Use the module level instrumentation object, and call report() at the end
+    of a run to see where the time went. Set callback to a function taking
+    (stageName, seconds) to be told as each stage finishes.
+    The "retry" stage is the time spent on attempts that failed the rematch
+    check, so it overlaps the graph build and matching stages.
+    fixtureDivisions merges the reports of its worker processes in with
+    merge(), but work done in searchFixtures' processes isn't recorded.
+    '''
+
+    def __init__(self, callback = None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all the recorded times and counts
+        '''
+        self.stageTimes = {}
+        self.stageCalls = {}
+        self.counters = {}
+        self.activeStages = set()
+
+    @contextmanager
+    def stage(self, stageName: str):
+        '''
+        Times the body of a with block as stageName. A stage started inside
+        itself (like a nested function call) is only timed once.
+        '''
+        if stageName in self.activeStages:
+            yield
+            return
+        self.activeStages.add(stageName)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.activeStages.discard(stageName)
+            self.addStageTime(stageName, time.perf_counter() - start)
+
+    def addStageTime(self, stageName: str, seconds: float):
+        '''
+        Adds a time in seconds to a stage
+        '''
+        self.stageTimes[stageName] = self.stageTimes.get(stageName, 0) + seconds
+        self.stageCalls[stageName] = self.stageCalls.get(stageName, 0) + 1
+        if self.callback is not None:
+            self.callback(stageName, seconds)
+
+    def count(self, counterName: str, amount: int = 1):
+        '''
+        Adds amount to a counter
+        '''
+        self.counters[counterName] = self.counters.get(counterName, 0) + amount
+
+    def merge(self, report: dict):
+        '''
+        Adds the times and counts of a report() from elsewhere, like another
+        process, to these ones. The callback isn't told about merged stages.
+        '''
+        for stageName, stage in report["stages"].items():
+            self.stageTimes[stageName] = self.stageTimes.get(stageName, 0) + \
+                    stage["seconds"]
+            self.stageCalls[stageName] = self.stageCalls.get(stageName, 0) + \
+                    stage["calls"]
+        for counterName, amount in report["counters"].items():
+            self.count(counterName, amount)
+
+    def report(self) -> dict:
+        '''
+        Returns the recorded times and counts as a dict that can be dumped to
+        JSON
+        '''
+        return {"stages":{stageName:{"seconds":seconds,
+                    "calls":self.stageCalls[stageName]}
+                    for stageName, seconds in self.stageTimes.items()},
+                "counters":dict(self.counters)}
+
+instrumentation = Instrumentation()
+
+def timedStage(stageName: str):
+    '''
+    Decorator that times every call of a function as stageName
+    '''
+    def decorator(function):
+        @wraps(function)
+        def timedFunction(*args, **kwargs):
+            with instrumentation.stage(stageName):
+                return function(*args, **kwargs)
+        return timedFunction
+    return decorator
+
+
+# Where downloaded workbooks and their parsed sheets are kept between runs
+WORKBOOK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache",
+        "graph-fixturing")
+
+# The index of the on-disk cache, which records the latest hash (and ETag)
+# of each workbook, and how many workbooks it keeps files for
+WORKBOOK_CACHE_INDEX = "index.json"
+WORKBOOK_CACHE_ENTRIES = 16
+
+# Parsed sheets of each workbook loaded by this process, keyed by URL
+workbookCache = {}
+
+def fetchWorkbookData(URL, cacheDir: str):
+    '''
+    Returns the contents hash of the workbook at URL, downloading it only if
+    it has changed since the last run. Remote workbooks are checked against
+    the ETag of the last download, and the raw file is kept in cacheDir under
+    its hash. Local files are read directly.
+    '''
+    if os.path.exists(URL):
+        with instrumentation.stage("download"):
+            with open(URL, 'rb') as workbookFile:
+                data = workbookFile.read()
+        dataHash = storeWorkbookData(data, cacheDir)
+        updateWorkbookCacheIndex(cacheDir, os.path.abspath(URL), dataHash)
+        return dataHash
+
+    cached = readWorkbookCacheIndex(cacheDir).get(URL)
+    request = urllib.request.Request(URL)
+    if cached is not None and cached["etag"] is not None and os.path.exists(
+            os.path.join(cacheDir, cached["hash"] + ".xlsx")):
+        request.add_header("If-None-Match", cached["etag"])
+    try:
+        with instrumentation.stage("download"):
+            with urllib.request.urlopen(request) as response:
+                data = response.read()
+                etag = response.headers.get("ETag")
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            updateWorkbookCacheIndex(cacheDir, URL, cached["hash"],
+                    cached["etag"])
+            return cached["hash"]
+        raise
+
+    dataHash = storeWorkbookData(data, cacheDir)
+    updateWorkbookCacheIndex(cacheDir, URL, dataHash, etag)
+    return dataHash
+
+def readWorkbookCacheIndex(cacheDir: str) -> dict:
+    '''
+    Returns the index of the workbook cache in cacheDir, a dict keyed by URL
+    (or absolute path) of the latest hash and ETag of each workbook
+    '''
+    indexPath = os.path.join(cacheDir, WORKBOOK_CACHE_INDEX)
+    if not os.path.exists(indexPath):
+        return {}
+    with open(indexPath, 'r') as indexFile:
+        return json.load(indexFile)
+
+def updateWorkbookCacheIndex(cacheDir: str, URL: str, dataHash: str,
+        etag: str = None):
+    '''
+    Records dataHash as the latest version of the workbook at URL, and evicts
+    everything else from the cache in cacheDir: older versions of the
+    workbook, and all but the WORKBOOK_CACHE_ENTRIES most recently used
+    workbooks
+    '''
+    index = readWorkbookCacheIndex(cacheDir)
+    index[URL] = {"hash":dataHash, "etag":etag, "used":time.time()}
+    recent = sorted(index, key = lambda key: index[key]["used"],
+            reverse = True)[:WORKBOOK_CACHE_ENTRIES]
+    index = {key:index[key] for key in recent}
+    os.makedirs(cacheDir, exist_ok=True)
+    with open(os.path.join(cacheDir, WORKBOOK_CACHE_INDEX), 'w') as indexFile:
+        json.dump(index, indexFile)
+
+    # Only touch files named like the cache's own, in case cacheDir is shared
+    keptHashes = {entry["hash"] for entry in index.values()}
+    for fileName in os.listdir(cacheDir):
+        fileHash, extension = os.path.splitext(fileName)
+        if extension in (".xlsx", ".pkl") and len(fileHash) == 64 and \
+                all(character in "0123456789abcdef" for character in fileHash) \
+                and fileHash not in keptHashes:
+            os.remove(os.path.join(cacheDir, fileName))
+
+def storeWorkbookData(data: bytes, cacheDir: str) -> str:
+    '''
+    Saves the raw workbook to cacheDir under its contents hash, and returns
+    the hash
+    '''
+    dataHash = hashlib.sha256(data).hexdigest()
+    os.makedirs(cacheDir, exist_ok=True)
+    dataPath = os.path.join(cacheDir, dataHash + ".xlsx")
+    if not os.path.exists(dataPath):
+        with open(dataPath, 'wb') as dataFile:
+            dataFile.write(data)
+    return dataHash
+
+def loadWorkbook(URL, tables: list = None, cacheDir: str = None) -> dict:
+    '''
+    Loads a workbook from a URL or a local path, returning a dict of
+    DataFrames keyed by table name. Pass the names of all the tables a run
+    needs, so the workbook is downloaded once and all of them are parsed in
+    one pass. Pass tables = None to load every table.
+    Parsed tables are cached in memory for the rest of the run, and on disk
+    in cacheDir (WORKBOOK_CACHE_DIR by default) against the hash of the
+    workbook, so later runs on an unchanged workbook skip the parse. The disk
+    cache only keeps the latest version of each workbook, see
+    updateWorkbookCacheIndex().
+    '''
+    if cacheDir is None:
+        cacheDir = WORKBOOK_CACHE_DIR
+    loaded = workbookCache.setdefault(URL, {})
+    if tables is not None and all(table in loaded for table in tables):
+        return {table:loaded[table] for table in tables}
+
+    dataHash = fetchWorkbookData(URL, cacheDir)
+    parsedPath = os.path.join(cacheDir, dataHash + ".pkl")
+    parsed = {}
+    with instrumentation.stage("parse"):
+        if os.path.exists(parsedPath):
+            with open(parsedPath, 'rb') as parsedFile:
+                parsed = pickle.load(parsedFile)
+
+        missing = None if tables is None else [table for table in tables
+                if table not in parsed]
+        if missing is None or missing:
+            with open(os.path.join(cacheDir, dataHash + ".xlsx"), 'rb') as dataFile:
+                parsed.update(pd.read_excel(io.BytesIO(dataFile.read()),
+                    sheet_name = missing))
+            with open(parsedPath, 'wb') as parsedFile:
+                pickle.dump(parsed, parsedFile)
+
+    # A changed workbook replaces anything loaded earlier in the run
+    loaded.clear()
+    loaded.update(parsed)
+    if tables is None:
+        return dict(parsed)
+    return {table:parsed[table] for table in tables}
+
+class DataSource(ABC):
+    '''
+    Somewhere to load the league tables (results, starting Elos, fixtured
+    games, requests) from. Subclasses implement loadTables(), and the loaders
+    below (getDataFromRemote, getResults, getRatings) take a DataSource
+    wherever they take a URL.
+    '''
+
+    @abstractmethod
+    def loadTables(self, tables: list = None) -> dict:
+        '''
+        Returns a dict of DataFrames keyed by table name. Pass the names of
+        all the tables a run needs so they can be loaded in one pass, or
+        tables = None to load every table.
+        '''
+
+    def loadTable(self, table: str) -> pd.DataFrame:
+        '''
+        Returns a single table as a DataFrame
+        '''
+        return self.loadTables([table])[table]
+
+class WorkbookSource(DataSource):
+    '''
+    An xlsx workbook, either at a URL or a local path. See loadWorkbook() for
+    how downloads and parses are cached.
+    '''
+
+    def __init__(self, URL: str, cacheDir: str = None):
+        self.URL = URL
+        self.cacheDir = cacheDir
+
+    def loadTables(self, tables: list = None) -> dict:
+        return loadWorkbook(self.URL, tables, self.cacheDir)
+
+SNAPSHOT_FORMATS = ("parquet", "feather")
+SNAPSHOT_MANIFEST = "manifest.json"
+
+class SnapshotSource(DataSource):
+    '''
+    A directory of Parquet or Feather files, one per table, written by
+    writeSnapshot(). A manifest maps each table name to its file, as sheet
+    names aren't always usable as file names. Needs pyarrow.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, SNAPSHOT_MANIFEST)) as manifestFile:
+            manifest = json.load(manifestFile)
+        self.format = manifest["format"]
+        self.files = manifest["tables"]
+        self.tables = {}
+
+    def loadTables(self, tables: list = None) -> dict:
+        if tables is None:
+            tables = list(self.files.keys())
+        missing = [table for table in tables if table not in self.files]
+        if missing:
+            raise KeyError("Tables %s aren't in the snapshot at %s"
+                    %(missing, self.path))
+        with instrumentation.stage("parse"):
+            for table in tables:
+                if table not in self.tables:
+                    tablePath = self.getTablePath(table)
+                    if self.format == "parquet":
+                        self.tables[table] = pd.read_parquet(tablePath)
+                    else:
+                        self.tables[table] = pd.read_feather(tablePath)
+        return {table:self.tables[table] for table in tables}
+
+    def getTablePath(self, table: str) -> str:
+        '''
+        Returns the path of the file holding a table
+        '''
+        if table not in self.files:
+            raise KeyError("Table %s isn't in the snapshot at %s"
+                    %(table, self.path))
+        return os.path.join(self.path, self.files[table])
+
+def getSnapshotFileName(table: str, index: int, snapshotFormat: str) -> str:
+    '''
+    Returns a file name for a table in a snapshot, keeping the letters and
+    digits of the table name for readability and the index so names are unique
+    '''
+    safeName = "".join(character if character.isalnum() else "_"
+            for character in table)
+    return "%02i_%s.%s" %(index, safeName, snapshotFormat)
+
+def writeSnapshot(source, path: str, tables: list = None,
+        snapshotFormat: str = "parquet") -> SnapshotSource:
+    '''
+    Converts the tables of a data source (or anything getDataSource accepts)
+    into a Parquet or Feather snapshot in the directory path, returning it as
+    a SnapshotSource. Pass tables = None to convert every table.
+    Spreadsheet columns holding a mix of types (e.g. numbers and text) are
+    stored as text, since the columnar formats need one type per column.
+    '''
+    if snapshotFormat not in SNAPSHOT_FORMATS:
+        raise ValueError("Unknown snapshot format %s, use one of %s"
+                %(snapshotFormat, SNAPSHOT_FORMATS))
+    loaded = getDataSource(source).loadTables(tables)
+    os.makedirs(path, exist_ok = True)
+    files = {}
+    for index, (table, data) in enumerate(loaded.items()):
+        data = data.copy()
+        for column in data.columns[data.dtypes == object]:
+            valueTypes = set(type(value) for value in data[column].dropna())
+            if len(valueTypes) > 1:
+                data[column] = data[column].map(lambda value: value
+                        if pd.isna(value) else str(value))
+        # Column names have to be strings in both formats
+        data.columns = [str(column) for column in data.columns]
+        data = data.reset_index(drop = True)
+        files[table] = getSnapshotFileName(table, index, snapshotFormat)
+        tablePath = os.path.join(path, files[table])
+        if snapshotFormat == "parquet":
+            data.to_parquet(tablePath)
+        else:
+            data.to_feather(tablePath)
+    with open(os.path.join(path, SNAPSHOT_MANIFEST), 'w') as manifestFile:
+        json.dump({"format":snapshotFormat, "tables":files}, manifestFile,
+                indent = 2)
+    dataSources.pop(path, None)
+    return SnapshotSource(path)
+
+# Data sources made from URLs and paths, so each is only set up once a run
+dataSources = {}
+
+def getDataSource(source) -> DataSource:
+    '''
+    Returns a DataSource for source, which may already be a DataSource, a
+    snapshot directory written by writeSnapshot(), or the URL or path of an
+    xlsx workbook
+    '''
+    if isinstance(source, DataSource):
+        return source
+    if source not in dataSources:
+        if os.path.isfile(os.path.join(source, SNAPSHOT_MANIFEST)):
+            dataSources[source] = SnapshotSource(source)
+        else:
+            dataSources[source] = WorkbookSource(source)
+    return dataSources[source]
 
 def getDataFromRemote(URL, table):
     '''
     When passed a valid URL and a table name, will download the URL as a .xls
-    and perform minimal cleaning, returning a DataFrame
+    and perform minimal cleaning, returning a DataFrame.
+    URL can also be a local workbook, a snapshot directory or a DataSource,
+    see getDataSource(). The workbook is only downloaded if it hasn't already
+    been loaded, see loadWorkbook().
     '''
-    results = pd.read_excel(URL, sheet_name = table).dropna(how='all')
+    results = getDataSource(URL).loadTable(table).dropna(how='all')
     return results
 
 def getResults(URL, table):
@@ -31,7 +443,8 @@ def getResults(URL, table):
     style data (including results and previous fixtures)
     '''
     results = getDataFromRemote(URL, table)
-    results.sort_values(by='Round',inplace=True)
+    # Use a stable sort so games keep their sheet order within a round
+    results.sort_values(by='Round',inplace=True,kind='stable')
     return results
 
 def getRatings(URL, table, teamNameCol, teamEloCol, teamKCol):
@@ -85,6 +498,112 @@ def getDeviation(expected: float, outcome: float, elo:float, kValue: float) -> f
     newElo = elo + kValue * deviation
     return newElo
 
+def getReplayBatches(homeIds: np.ndarray, awayIds: np.ndarray) -> np.ndarray:
+    '''
+    Splits a round of games into batches where no team plays twice, returning
+    the batch number of each game. Each team's games stay in their original
+    order, so replaying the batches one after the other gives the same Elos as
+    replaying the games one at a time.
+    '''
+    lastBatch = {}
+    batches = np.zeros(len(homeIds), dtype=int)
+    for game, (homeId, awayId) in enumerate(zip(homeIds.tolist(),
+            awayIds.tolist())):
+        batch = max(lastBatch.get(homeId, -1), lastBatch.get(awayId, -1)) + 1
+        lastBatch[homeId] = batch
+        lastBatch[awayId] = batch
+        batches[game] = batch
+    return batches
+
+@timedStage("elo replay")
+def replayElos(elos: dict, results: pd.DataFrame, kValues: dict,
+        returnTrajectory: bool = False):
+    '''
+    Replays a DataFrame of results in round order, updating the Elo of each
+    team in the same way as getExpectedOutcome() and getDeviation(). The
+    columns are pulled out as arrays once, and games within a round that
+    share no teams are updated together.
+    Rows missing either score are games that haven't been played yet, and are
+    skipped. A 0-0 result has no points to split, so it is treated as a draw.
+    Every team that plays needs a K value, or a KeyError is raised.
+    Returns the dict of (updated) Elos, or (elos, trajectory) if
+    returnTrajectory is set, where trajectory is a DataFrame of every team's
+    Elo after each round, indexed by round.
+    Uses the same columns as updateElosFromResults(), plus "Round" if present.
+    '''
+    played = results['Home Score'].notna() & results['Away Score'].notna()
+    if not played.all():
+        results = results[played]
+    missingKValues = sorted(set(results['Home Team']).union(
+        results['Away Team']).difference(kValues))
+    if missingKValues:
+        raise KeyError("No K value for %s" %", ".join(map(str, missingKValues)))
+
+    teams = list(elos.keys())
+    teamIndex = {team:index for index, team in enumerate(teams)}
+    eloArray = np.array([elos[team] for team in teams], dtype=float)
+    # Teams without a K value don't play in these results
+    kArray = np.array([kValues.get(team, 0) for team in teams], dtype=float)
+
+    homeIds = np.array([teamIndex[team] for team in results['Home Team']],
+            dtype=int)
+    awayIds = np.array([teamIndex[team] for team in results['Away Team']],
+            dtype=int)
+    homeScores = results['Home Score'].to_numpy(dtype=float)
+    awayScores = results['Away Score'].to_numpy(dtype=float)
+    if 'Round' in results.columns:
+        rounds = results['Round'].to_numpy()
+    else:
+        rounds = np.zeros(len(homeIds))
+
+    # Stable sort, so games within a round keep their order in the sheet
+    order = np.argsort(rounds, kind='stable')
+    homeIds, awayIds = homeIds[order], awayIds[order]
+    homeScores, awayScores = homeScores[order], awayScores[order]
+    rounds = rounds[order]
+    # Split the points like getGameOutcome(), with 0-0 as a draw
+    totalScores = homeScores + awayScores
+    homeScorePercs = np.divide(homeScores, totalScores,
+            out=np.full(len(totalScores), 0.5), where=totalScores > 0)
+
+    roundNames = []
+    trajectory = []
+    roundStarts = np.flatnonzero(np.r_[True, rounds[1:] != rounds[:-1]]) \
+            if len(rounds) else np.array([], dtype=int)
+    roundEnds = np.r_[roundStarts[1:], len(rounds)]
+    for start, end in zip(roundStarts.tolist(), roundEnds.tolist()):
+        batches = getReplayBatches(homeIds[start:end], awayIds[start:end])
+        for batch in range(batches.max() + 1):
+            games = start + np.flatnonzero(batches == batch)
+            home = homeIds[games]
+            away = awayIds[games]
+            homeElo = eloArray[home]
+            awayElo = eloArray[away]
+
+            homeExpected = 1/(1+10**-((homeElo - awayElo)/400.0))
+            homeNewElo = homeElo + kArray[home]*(homeScorePercs[games] - homeExpected)
+            awayNewElo = awayElo + kArray[away]*(homeExpected - homeScorePercs[games])
+
+            # Ensure winning teams don't lose Elo
+            homeWon = homeScores[games] > awayScores[games]
+            awayWon = homeScores[games] < awayScores[games]
+            homeNewElo = np.where(homeWon, np.maximum(homeElo, homeNewElo), homeNewElo)
+            awayNewElo = np.where(awayWon, np.maximum(awayElo, awayNewElo), awayNewElo)
+
+            eloArray[home] = homeNewElo
+            eloArray[away] = awayNewElo
+
+        if returnTrajectory:
+            roundNames.append(rounds[start])
+            trajectory.append(eloArray.copy())
+
+    elos.update(zip(teams, eloArray.tolist()))
+    if returnTrajectory:
+        trajectoryDF = pd.DataFrame(trajectory, index=roundNames, columns=teams)
+        trajectoryDF.index.name = 'Round'
+        return (elos, trajectoryDF)
+    return elos
+
 def updateElosFromResults(elos: dict, results: pd.DataFrame, kValues: dict) -> dict:
     '''
     Loops through the dataframe of results, and updates the Elo of each team
@@ -94,64 +613,509 @@ def updateElosFromResults(elos: dict, results: pd.DataFrame, kValues: dict) -> d
         AwayTeam is kept in column "Away Team"
         Home Score is kept in column "Home Score"
         Away Score is kept in column "Away Score"
+    Games are replayed in the order of the "Round" column, see replayElos().
     '''
-    for gameRow in range(len(results.index)):
-        # Grab data from the df
-        homeTeam = results.loc[gameRow,'Home Team']
-        awayTeam = results.loc[gameRow,'Away Team']
-        homeK = kValues[homeTeam]
-        awayK = kValues[awayTeam]
-        homeElo = elos[homeTeam]
-        awayElo = elos[awayTeam]
-        homeScore = results.loc[gameRow,'Home Score']
-        awayScore = results.loc[gameRow,'Away Score']
+    return replayElos(elos, results, kValues)
 
-        # Start processing
-        homeScorePerc, awayScorePerc = getGameOutcome(homeScore, awayScore)
-        homeExpected, awayExpected = getExpectedOutcome(homeElo, awayElo)
-        homeNewElo = getDeviation(homeExpected, homeScorePerc, homeElo, homeK)
-        awayNewElo = getDeviation(awayExpected, awayScorePerc, awayElo, awayK)
+RESULTS_COLUMNS = ['Round', 'Home Team', 'Away Team', 'Home Score', 'Away Score']
 
-        # Ensure winning teams don't lose Elo
-        if homeScore > awayScore:
-            homeNewElo = max(homeElo, homeNewElo)
-        if homeScore < awayScore:
-            awayNewElo = max(awayElo, awayNewElo)
+def hashResults(results: pd.DataFrame) -> str:
+    '''
+    Returns a hash of the games in a results DataFrame, in the order they
+    appear
+    '''
+    resultsHash = hashlib.sha256()
+    columns = [column for column in RESULTS_COLUMNS if column in results.columns]
+    for row in results[columns].astype(str).itertuples(index=False, name=None):
+        resultsHash.update("\x1f".join(row).encode('utf-8'))
+        resultsHash.update(b"\x1e")
+    return resultsHash.hexdigest()
 
-        # Create the updated Elos to push to the dict
-        updatedElos = {homeTeam:homeNewElo, awayTeam: awayNewElo}
-        elos.update(updatedElos)
+def hashRatings(elos: dict, kValues: dict) -> str:
+    '''
+    Returns a hash of a set of starting Elos and K values
+    '''
+    ratings = sorted((str(team), float(elos[team]), float(kValues.get(team, 0)))
+            for team in elos)
+    return hashlib.sha256(json.dumps(ratings).encode('utf-8')).hexdigest()
 
+def loadEloCheckpoint(checkpointPath: str) -> dict:
+    '''
+    Returns the checkpoint saved at checkpointPath, or None if there isn't one
+    '''
+    if not os.path.exists(checkpointPath):
+        return None
+    with open(checkpointPath, 'r') as checkpointFile:
+        return json.load(checkpointFile)
+
+def saveEloCheckpoint(checkpointPath: str, elos: dict, kValues: dict,
+        lastRound, rowCount: int, resultsHash: str, startingHash: str):
+    '''
+    Saves the Elos after replaying the first rowCount results, along with
+    what is needed to check the results haven't changed since
+    '''
+    if hasattr(lastRound, "item"):
+        lastRound = lastRound.item()
+    checkpoint = {"elos":{team:float(elo) for team, elo in elos.items()},
+            "kValues":{team:float(k) for team, k in kValues.items()},
+            "lastRound":lastRound,
+            "rowCount":rowCount,
+            "resultsHash":resultsHash,
+            "startingHash":startingHash}
+    with open(checkpointPath, 'w') as checkpointFile:
+        json.dump(checkpoint, checkpointFile, indent=2)
+
+def updateElosWithCheckpoint(elos: dict, results: pd.DataFrame, kValues: dict,
+        checkpointPath: str) -> dict:
+    '''
+    Does the same as updateElosFromResults(), but saves the replayed Elos to a
+    checkpoint file so that later runs only replay the results added since.
+    If any of the results covered by the checkpoint have been edited, or the
+    starting Elos or K values have changed, all the results are replayed.
+    Returns a dict of (updated) Elos.
+    '''
+    if 'Round' in results.columns:
+        results = results.sort_values(by='Round', kind='stable')
+    startingHash = hashRatings(elos, kValues)
+
+    checkpoint = loadEloCheckpoint(checkpointPath)
+    newResults = results
+    if (checkpoint is not None and checkpoint["startingHash"] == startingHash
+            and checkpoint["rowCount"] <= len(results.index)
+            and hashResults(results.iloc[:checkpoint["rowCount"]]) ==
+            checkpoint["resultsHash"]):
+        elos.update(checkpoint["elos"])
+        newResults = results.iloc[checkpoint["rowCount"]:]
+    elif checkpoint is not None:
+        print("Results have changed since the Elo checkpoint, replaying all results")
+
+    elos = replayElos(elos, newResults, kValues)
+
+    lastRound = None
+    if 'Round' in results.columns and len(results.index):
+        lastRound = results['Round'].iloc[-1]
+    saveEloCheckpoint(checkpointPath, elos, kValues, lastRound,
+            len(results.index), hashResults(results), startingHash)
     return elos
 
-def checkIfGameInList(teamA: str, teamB: str, gamesList: list) -> (bool,int):
+def readResultBatches(source, table: str = None, chunkSize: int = 100000):
+    '''
+    Reads the results columns from a file in batches of up to chunkSize rows,
+    without loading the whole file. source is the path of a CSV, Parquet or
+    Feather file, or a snapshot (see getDataSource()) along with the name of
+    the results table in it. Parquet and Feather need pyarrow.
+    '''
+    if table is not None:
+        dataSource = getDataSource(source)
+        if not isinstance(dataSource, SnapshotSource):
+            raise ValueError("Only CSV files and snapshots can be streamed, "
+                    "convert the workbook with writeSnapshot() first")
+        source = dataSource.getTablePath(table)
+
+    if source.endswith(".csv"):
+        yield from pd.read_csv(source, chunksize = chunkSize,
+                usecols = RESULTS_COLUMNS)
+    elif source.endswith(".parquet"):
+        import pyarrow.parquet
+        parquetFile = pyarrow.parquet.ParquetFile(source)
+        for batch in parquetFile.iter_batches(batch_size = chunkSize,
+                columns = RESULTS_COLUMNS):
+            yield batch.to_pandas()
+    elif source.endswith(".feather"):
+        import pyarrow
+        import pyarrow.ipc
+        # Memory map the file, so only the batch being read is paged in
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(source))
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index).select(RESULTS_COLUMNS)
+            for start in range(0, batch.num_rows, chunkSize):
+                yield batch.slice(start, chunkSize).to_pandas()
+    else:
+        raise ValueError("Can't stream results from %s, expected a .csv, "
+                ".parquet or .feather file" %source)
+
+def iterResultChunks(source, table: str = None, chunkSize: int = 100000):
+    '''
+    Streams results from a file (see readResultBatches()) as DataFrames of
+    whole rounds, in round order. Each chunk is about chunkSize rows, plus the
+    rest of the round it ends in, so a round is never split across chunks.
+    Within a round, games keep their order in the file, so replaying the
+    chunks one after the other matches getResults() and
+    updateElosFromResults() on the whole file.
+    The file only has to be in round order overall: rows can be out of order
+    within a batch, but a ValueError is raised if a round turns up after a
+    later round has been yielded.
+    '''
+    pending = None
+    yieldedRound = None
+    for batch in readResultBatches(source, table, chunkSize):
+        batch = batch.dropna(how='all')
+        if len(batch) == 0:
+            continue
+        if yieldedRound is not None and (batch['Round'] <= yieldedRound).any():
+            raise ValueError("Results in %s aren't in round order, round %s "
+                    "appears after later rounds" %(source,
+                        batch['Round'][batch['Round'] <= yieldedRound].iloc[0]))
+        if pending is not None:
+            batch = pd.concat([pending, batch], ignore_index = True)
+        # Stable sort, so games within a round keep their order in the file
+        batch = batch.sort_values(by='Round', kind='stable')
+
+        # Hold back the last round, as it may carry on into the next batch
+        lastRound = batch['Round'].iloc[-1]
+        complete = (batch['Round'] < lastRound).to_numpy()
+        pending = batch[~complete]
+        if complete.any():
+            yield batch[complete]
+            yieldedRound = batch['Round'][complete].iloc[-1]
+    if pending is not None and len(pending):
+        yield pending
+
+def updateElosFromStream(elos: dict, chunks, kValues: dict) -> dict:
+    '''
+    Replays results chunk by chunk (see iterResultChunks()), so only the
+    current Elos and one chunk of results are in memory at a time. The chunks
+    must be in round order. Returns the dict of (updated) Elos.
+    '''
+    for chunk in chunks:
+        elos = replayElos(elos, chunk, kValues)
+    return elos
+
+def parseGameCode(gameCode: str) -> (str, str):
+    '''
+    Splits a game code of the form "Home Team vs Away Team" into a
+    (homeTeam, awayTeam) tuple
+    '''
+    homeTeam, awayTeam = gameCode.split(" vs ", 1)
+    return (homeTeam, awayTeam)
+
+class GameHistory:
+    '''
+    An indexed store of games between pairs of teams. Team names are interned
+    to integer IDs on first sight, and games are counted against the unordered
+    pair of IDs, so looking up how many times two teams have played is O(1)
+    regardless of how much history there is.
+    Build it once from a list of game codes (fixtured games, requests, etc) and
+    add new rounds to it as they are fixtured.
+    Tentative rounds can be staged with begin(), and then kept with commit()
+    or undone with rollback(). Only the staged games are logged, so both take
+    time in proportion to the games staged rather than the whole history.
+    '''
+
+    def __init__(self, gameCodes: list = ()):
+        self.teamIds = {}
+        self.pairCounts = {}
+        self.homeCounts = {}
+        self.awayCounts = {}
+        self.undoLog = None
+        self.addGames(gameCodes)
+
+    def begin(self):
+        '''
+        Starts staging games, so they can be undone with rollback()
+        '''
+        if self.undoLog is not None:
+            raise RuntimeError("Games are already being staged in this history")
+        self.undoLog = []
+
+    def commit(self):
+        '''
+        Keeps the games added since begin()
+        '''
+        self.undoLog = None
+
+    def rollback(self):
+        '''
+        Undoes the games added since begin()
+        '''
+        for pairKey, homeTeam, awayTeam in reversed(self.undoLog or []):
+            for counts, key in ((self.pairCounts, pairKey),
+                    (self.homeCounts, homeTeam), (self.awayCounts, awayTeam)):
+                counts[key] -= 1
+                if counts[key] == 0:
+                    del counts[key]
+        self.undoLog = None
+
+    def copy(self):
+        '''
+        Returns an independent copy of the history, including any staged
+        games but not the ability to roll them back
+        '''
+        history = GameHistory()
+        history.teamIds = dict(self.teamIds)
+        history.pairCounts = dict(self.pairCounts)
+        history.homeCounts = dict(self.homeCounts)
+        history.awayCounts = dict(self.awayCounts)
+        return history
+
+    def getTeamId(self, team: str) -> int:
+        '''
+        Returns the integer ID of a team, allocating a new one if required
+        '''
+        teamId = self.teamIds.get(team)
+        if teamId is None:
+            teamId = len(self.teamIds)
+            self.teamIds[sys.intern(team)] = teamId
+        return teamId
+
+    def getPairKey(self, teamA: str, teamB: str) -> (int, int):
+        '''
+        Returns the key used to store a game between two teams. The key is the
+        same no matter which team is home and which is away.
+        '''
+        idA = self.getTeamId(teamA)
+        idB = self.getTeamId(teamB)
+        if idA > idB:
+            return (idB, idA)
+        return (idA, idB)
+
+    def addGame(self, homeTeam: str, awayTeam: str):
+        '''
+        Record a single game between two teams
+        '''
+        pairKey = self.getPairKey(homeTeam, awayTeam)
+        self.pairCounts[pairKey] = self.pairCounts.get(pairKey, 0) + 1
+        self.homeCounts[homeTeam] = self.homeCounts.get(homeTeam, 0) + 1
+        self.awayCounts[awayTeam] = self.awayCounts.get(awayTeam, 0) + 1
+        if self.undoLog is not None:
+            self.undoLog.append((pairKey, homeTeam, awayTeam))
+
+    def addGames(self, gameCodes: list):
+        '''
+        Record a list of games, given as "Home Team vs Away Team" game codes
+        '''
+        for gameCode in gameCodes:
+            homeTeam, awayTeam = parseGameCode(gameCode)
+            self.addGame(homeTeam, awayTeam)
+
+    def count(self, teamA: str, teamB: str) -> int:
+        '''
+        Returns the number of games between two teams, in either order
+        '''
+        instrumentation.count("historyLookups")
+        idA = self.teamIds.get(teamA)
+        idB = self.teamIds.get(teamB)
+        if idA is None or idB is None:
+            return 0
+        if idA > idB:
+            idA, idB = idB, idA
+        return self.pairCounts.get((idA, idB), 0)
+
+    def getCountMatrix(self, teams: list) -> np.ndarray:
+        '''
+        Returns a symmetric matrix of game counts between the given teams, with
+        rows and columns in the same order as teams
+        '''
+        instrumentation.count("historyLookups", len(self.pairCounts))
+        idToIndex = {self.teamIds[team]:index for index, team in
+                enumerate(teams) if team in self.teamIds}
+        counts = np.zeros((len(teams), len(teams)))
+        for (idA, idB), count in self.pairCounts.items():
+            if idA in idToIndex and idB in idToIndex:
+                counts[idToIndex[idA], idToIndex[idB]] = count
+                counts[idToIndex[idB], idToIndex[idA]] = count
+        return counts
+
+def asGameHistory(games) -> GameHistory:
+    '''
+    Returns games as a GameHistory, building one from a list of game codes if
+    required
+    '''
+    if isinstance(games, GameHistory):
+        return games
+    return GameHistory(games)
+
+# Parsed game lists, kept so repeated runs on the same history (what-if runs,
+# simulated schedules) don't parse it again, see getHistoryCounts()
+HISTORY_CACHE_SIZE = 32
+historyCache = OrderedDict()
+
+def getHistoryCounts(teams: list, games) -> (np.ndarray, np.ndarray, np.ndarray):
+    '''
+    Returns (counts, homeCounts, awayCounts) for a list of game codes or a
+    GameHistory: the n x n matrix of how often each pair of teams has played,
+    and how many home and away games each team has had, all in the order of
+    teams.
+    Lists of game codes are parsed once and kept in a least recently used
+    cache of up to HISTORY_CACHE_SIZE entries, keyed by the teams and the
+    codes. Hits and misses are counted as "historyCacheHits" and
+    "historyCacheMisses" in the instrumentation report. A GameHistory can
+    change after it is passed in, so it is never cached.
+    The arrays returned are always copies, so they can be changed freely.
+    '''
+    key = None
+    if not isinstance(games, GameHistory):
+        key = (tuple(teams), tuple(games))
+        if key in historyCache:
+            instrumentation.count("historyCacheHits")
+            historyCache.move_to_end(key)
+            return tuple(count.copy() for count in historyCache[key])
+        instrumentation.count("historyCacheMisses")
+
+    history = asGameHistory(games)
+    counts = (history.getCountMatrix(teams).astype(int),
+            np.array([history.homeCounts.get(team, 0) for team in teams], dtype=int),
+            np.array([history.awayCounts.get(team, 0) for team in teams], dtype=int))
+    if key is not None:
+        historyCache[key] = counts
+        while len(historyCache) > HISTORY_CACHE_SIZE:
+            historyCache.popitem(last = False)
+        return tuple(count.copy() for count in counts)
+    return counts
+
+def checkIfGameInList(teamA: str, teamB: str, gamesList) -> (bool,int):
     '''
     Checks if a game is in a list. Pass it two teams and a list of games
-    (requests, previous games, etc) and it will return whether or not the game
-    is in the list as a bool and the count as (bool, count)
-    '''
-    isIn = False
-    count = 0
-    codeA = teamA + " vs " + teamB
-    codeB = teamB + " vs " + teamB
-    if codeA in gamesList:
-        isIn = True
-    if codeB in gamesList:
-        isIn = True
-    if isIn:                       # if the game is in the list, get the count
-        count = gamesList.count(codeA) + gamesList.count(codeB)
-    return (isIn, count)
-
-def createGameRating(teamA: str, teamB: str, elosDict: dict, fixturedGames:
-        list, requestedGames: list, antiRequestedGames: list) -> float:
+    (requests, previous games, etc) or a GameHistory and it will return whether
+    or not the game is in the list as a bool and the count as (bool, count)
+    '''
+    count = asGameHistory(gamesList).count(teamA, teamB)
+    return (count > 0, count)
+
+class League:
+    '''
+    A league held in arrays. Each team is given a dense integer ID (its index
+    in the sorted list of team names) once, when the League is built. The
+    Elos, K values and home and away game counts are arrays indexed by ID,
+    and the fixtured, requested and anti-requested games are n x n matrices
+    of how often each pair of IDs has played (or been requested).
+    The fixturing loops work on IDs only, and names are converted back with
+    getNames() when the fixture is output.
+    '''
+
+    def __init__(self, elos: dict, kValues: dict = None, fixtured = (),
+            requested = (), antiRequested = ()):
+        self.teams = sorted(elos.keys())
+        self.teamIds = {team:teamId for teamId, team in enumerate(self.teams)}
+        self.elos = np.array([elos[team] for team in self.teams], dtype=float)
+        self.kValues = None
+        if kValues is not None:
+            # Teams without a K value, like the "Bye Team", never change Elo
+            self.kValues = np.array([kValues.get(team, 0) for team in self.teams],
+                    dtype=float)
+
+        self.gameCounts, self.homeCounts, self.awayCounts = getHistoryCounts(
+                self.teams, fixtured)
+        self.requestedCounts = getHistoryCounts(self.teams, requested)[0]
+        self.antiRequestedCounts = getHistoryCounts(self.teams, antiRequested)[0]
+
+    def copy(self):
+        '''
+        Returns an independent copy of the league
+        '''
+        league = League.__new__(League)
+        league.teams = self.teams
+        league.teamIds = self.teamIds
+        for attribute in ("elos", "kValues", "gameCounts", "requestedCounts",
+                "antiRequestedCounts", "homeCounts", "awayCounts"):
+            value = getattr(self, attribute)
+            setattr(league, attribute, None if value is None else value.copy())
+        return league
+
+    def getIds(self, games) -> list:
+        '''
+        Converts a list of (homeTeam, awayTeam) games from names to IDs
+        '''
+        return [(self.teamIds[homeTeam], self.teamIds[awayTeam])
+                for homeTeam, awayTeam in games]
+
+    def getNames(self, games) -> list:
+        '''
+        Converts a list of (homeId, awayId) games from IDs to names
+        '''
+        return [(self.teams[homeId], self.teams[awayId])
+                for homeId, awayId in games]
+
+    def getEloDict(self) -> dict:
+        '''
+        Returns the Elos as a dict keyed by team name
+        '''
+        return {team:float(elo) for team, elo in zip(self.teams, self.elos)}
+
+    def getGameHistory(self) -> GameHistory:
+        '''
+        Returns the fixtured games as a GameHistory, for the functions that
+        work on names
+        '''
+        history = GameHistory()
+        for team in self.teams:
+            history.getTeamId(team)
+        rows, cols = np.nonzero(np.triu(self.gameCounts, 1))
+        history.pairCounts = {(int(idA), int(idB)):int(self.gameCounts[idA, idB])
+                for idA, idB in zip(rows, cols)}
+        history.homeCounts = {team:int(count) for team, count in
+                zip(self.teams, self.homeCounts) if count}
+        history.awayCounts = {team:int(count) for team, count in
+                zip(self.teams, self.awayCounts) if count}
+        return history
+
+    def addGames(self, games: list):
+        '''
+        Records a list of (homeId, awayId) games
+        '''
+        if not games:
+            return
+        homeIds, awayIds = np.array(games, dtype=int).T
+        np.add.at(self.gameCounts, (homeIds, awayIds), 1)
+        np.add.at(self.gameCounts, (awayIds, homeIds), 1)
+        np.add.at(self.homeCounts, homeIds, 1)
+        np.add.at(self.awayCounts, awayIds, 1)
+
+    def getHistoryRatings(self) -> np.ndarray:
+        '''
+        Returns the part of the game ratings that doesn't depend on Elo, see
+        createHistoryRatingsMatrix()
+        '''
+        historyRatings = 100 - self.gameCounts*10.0
+        historyRatings += np.where(self.requestedCounts > 0, 2, 0)
+        historyRatings -= np.where(self.antiRequestedCounts > 0, 10, 0)
+        return historyRatings
+
+    def orientPairings(self, pairings: list) -> list:
+        '''
+        Decides which team is at home for each of a list of (idA, idB)
+        pairings, see orientPairings()
+        '''
+        return [(idB, idA) if self.homeCounts[idA] > self.homeCounts[idB]
+                else (idA, idB) for idA, idB in pairings]
+
+    def projectElos(self, games: list, rng = None):
+        '''
+        Projects the Elos forward over a round of (homeId, awayId) games that
+        haven't been played yet, see projectElos(). Games that share no teams
+        are updated together, in batches that keep each team's games in order
+        (see getReplayBatches()), so a double round where each team plays
+        twice gives the same Elos as projecting the games one at a time.
+        '''
+        rng = getRng(rng)
+        if not games:
+            return
+        homeIds, awayIds = np.array(games, dtype=int).T
+        # Draw in the order of the games, like projectElos()
+        draws = np.array([rng.random() for game in games])
+        batches = getReplayBatches(homeIds, awayIds)
+        for batch in range(batches.max() + 1):
+            inBatch = batches == batch
+            home = homeIds[inBatch]
+            away = awayIds[inBatch]
+            homeExpected = 1/(1+10**-((self.elos[home] - self.elos[away])/400.0))
+            homeOutcome = (draws[inBatch] < homeExpected).astype(float)
+            self.elos[home] += self.kValues[home]*(homeOutcome - homeExpected)
+            self.elos[away] += self.kValues[away]*(homeExpected - homeOutcome)
+
+def createGameRating(teamA: str, teamB: str, elosDict: dict, fixturedGames,
+        requestedGames, antiRequestedGames) -> float:
     '''
     Evaluate how good a game will be, based on:
       - The teams Elos
       - Whether the game has happened before
       - Whether the game has been requested
       - Whether the game has been requested to not happen
+    The game lists can be lists of game codes or GameHistory objects. Pass
+    GameHistory objects when rating many games, so the lists aren't rescanned.
     Returns a float indicating how good the game is. Higher is "better"
     '''
+    instrumentation.count("edgesEvaluated")
     eloA = elosDict[teamA]
     eloB = elosDict[teamB]
     # Get the expected outcome. We only use the outcome with respect to team A
@@ -179,103 +1143,612 @@ def createGameRating(teamA: str, teamB: str, elosDict: dict, fixturedGames:
     # weighted matching
     return max(gameRating,0)
 
-def createGameRatingsGraph(fixturedGames: list, requestedGames: list,
-        antiRequestedGames: list, elosDict: dict) -> nx.Graph():
+def createHistoryRatingsMatrix(teams: list, fixturedGames, requestedGames,
+        antiRequestedGames) -> np.ndarray:
+    '''
+    Returns the part of the game ratings that doesn't depend on Elo, as an
+    n x n matrix with rows and columns in the same order as teams. This is the
+    starting rating of 100 adjusted for rematches, requests and anti-requests.
+    The game lists can be lists of game codes or GameHistory objects.
+    '''
+    fixturedCounts = getHistoryCounts(teams, fixturedGames)[0].astype(float)
+    requestedCounts = getHistoryCounts(teams, requestedGames)[0]
+    antiRequestedCounts = getHistoryCounts(teams, antiRequestedGames)[0]
+
+    historyRatings = 100 - fixturedCounts*10
+    historyRatings = historyRatings + np.where(requestedCounts > 0, 2, 0)
+    historyRatings = historyRatings - np.where(antiRequestedCounts > 0, 10, 0)
+    return historyRatings
+
+@timedStage("graph build")
+def createEloRatingsMatrix(teams: list, elosDict: dict) -> np.ndarray:
+    '''
+    Returns the part of the game ratings that depends on Elo, which is the
+    scaled expected outcome of each game, as an n x n matrix with rows and
+    columns in the same order as teams.
+    '''
+    return getEloRatings(np.array([elosDict[team] for team in teams],
+        dtype=float))
+
+@timedStage("graph build")
+def getEloRatings(elos: np.ndarray) -> np.ndarray:
+    '''
+    Returns the Elo part of the game ratings for an array of Elos, see
+    createEloRatingsMatrix()
+    '''
+    instrumentation.count("edgesEvaluated", len(elos)*(len(elos) - 1)//2)
+    expectedOutcomes = 1/(1+10**-((elos[:,None] - elos[None,:])/400.0))
+    return 2*(0.5-np.abs(expectedOutcomes - 0.5))
+
+@timedStage("graph build")
+def combineRatingsMatrices(historyRatings: np.ndarray,
+        eloRatings: np.ndarray) -> np.ndarray:
+    '''
+    Combines the history and Elo parts of the game ratings into the final
+    ratings matrix
+    '''
+    gameRatings = historyRatings + eloRatings
+    # Ensure we don't use negative ratings as they cause issues with maximally
+    # weighted matching
+    gameRatings = np.maximum(gameRatings, 0)
+    np.fill_diagonal(gameRatings, 0)
+    return gameRatings
+
+@timedStage("graph build")
+def createGameRatingsMatrix(teams: list, elosDict: dict, fixturedGames,
+        requestedGames, antiRequestedGames) -> np.ndarray:
+    '''
+    Rates every possible game between the given teams in one pass, returning
+    an n x n matrix with rows and columns in the same order as teams. Each
+    entry matches createGameRating() for that pair of teams, and the diagonal
+    is zero.
+    The game lists can be lists of game codes or GameHistory objects.
+    '''
+    historyRatings = createHistoryRatingsMatrix(teams, fixturedGames,
+            requestedGames, antiRequestedGames)
+    eloRatings = createEloRatingsMatrix(teams, elosDict)
+    return combineRatingsMatrices(historyRatings, eloRatings)
+
+def createGameRatingsGraph(fixturedGames, requestedGames, antiRequestedGames,
+        elosDict: dict, topK: int = None) -> nx.Graph():
     '''
     Creates and returns a graph (not in the chart sense) of all possible games
     between all possible teams. Each node in the graph is a team, and each edge
     in the graph represents a game between the two teams, with an edge with a
     weight representing "how good" the game will be.
+    The game lists can be lists of game codes or GameHistory objects.
+    If topK is given, only each team's topK best rated games are kept, see
+    createCandidateGraph().
+    '''
+    teams = list(elosDict.keys())
+    gameRatings = createGameRatingsMatrix(teams, elosDict, fixturedGames,
+            requestedGames, antiRequestedGames)
+    if topK is not None:
+        return createCandidateGraph(gameRatings, teams, topK)
+    return createGraphFromMatrix(gameRatings, teams)
+
+@timedStage("graph build")
+def createCandidateGraph(gameRatings: np.ndarray, teams: list,
+        topK: int) -> nx.Graph():
     '''
-    teams = elosDict.keys()
+    Creates a sparse game ratings graph from a ratings matrix, keeping only the
+    topK best rated opponents of each team. A game is kept if it is in the top
+    topK for either team, so the graph has at most n*topK edges rather than
+    n(n-1)/2.
+    '''
+    teamCount = len(teams)
+    topK = min(topK, teamCount - 1)
+    if topK <= 0:
+        return createGraphFromMatrix(gameRatings, teams)
+
+    # Make sure a team is never picked as its own opponent
+    ratings = np.array(gameRatings, dtype=float)
+    np.fill_diagonal(ratings, -np.inf)
+    opponents = np.argpartition(-ratings, topK - 1, axis=1)[:, :topK]
+    rows = np.repeat(np.arange(teamCount), topK)
+    cols = opponents.ravel()
+    pairs = np.unique(np.stack([np.minimum(rows, cols), np.maximum(rows, cols)],
+        axis=1), axis=0)
 
+    teamsArray = np.array(teams, dtype=object)
     fixtureGraph = nx.Graph()
     fixtureGraph.add_nodes_from(teams)
-    for teamA in teams:
-        for teamB in teams:
-            if teamA != teamB and not fixtureGraph.has_edge(teamA, teamB):
-                edgeWeight = createGameRating(teamA, teamB, elosDict,
-                        fixturedGames, requestedGames, antiRequestedGames)
-                fixtureGraph.add_edge(teamA, teamB, weight = edgeWeight)
+    fixtureGraph.add_weighted_edges_from(zip(teamsArray[pairs[:, 0]].tolist(),
+            teamsArray[pairs[:, 1]].tolist(),
+            gameRatings[pairs[:, 0], pairs[:, 1]].tolist()))
     return fixtureGraph
 
-def getHomeGameCounts(teams: set, fixturedGames: list) -> dict:
+def getCandidatePairings(gameRatings: np.ndarray, teams: list,
+        topK: int) -> list:
     '''
-    Given a list of teams and a list of games, returns a dict of how many home
-    games each tam has had.
+    Finds the maximally weighted pairings using only each team's topK best
+    rated games (see createCandidateGraph()). If that doesn't pair up every
+    team, topK is doubled until it does, falling back to the complete graph.
+    Returns a list of (teamA, teamB) pairings.
     '''
-    homeGameCounts = {team:0 for team in teams}
-    for team in teams:
-        for game in fixturedGames:
-            if game.startswith(team):
-                homeGameCounts[team] += 1
-    return homeGameCounts
+    while topK < len(teams) - 1:
+        pairings = getMaxWeightPairings(createCandidateGraph(gameRatings, teams,
+            topK))
+        if len(pairings) == len(teams)//2:
+            return pairings
+        topK = 2*topK
+    return getMaxWeightPairings(gameRatings, teams)
 
+@timedStage("graph build")
+def createGraphFromMatrix(gameRatings: np.ndarray, teams: list) -> nx.Graph():
+    '''
+    Creates a game ratings graph from a ratings matrix, whose rows and columns
+    are in the same order as teams
+    '''
+    # Load the upper triangle of the ratings into the graph in one go
+    rows, cols = np.triu_indices(len(teams), 1)
+    teamsArray = np.array(teams, dtype=object)
+    fixtureGraph = nx.Graph()
+    fixtureGraph.add_nodes_from(teams)
+    fixtureGraph.add_weighted_edges_from(zip(teamsArray[rows].tolist(),
+            teamsArray[cols].tolist(), gameRatings[rows, cols].tolist()))
+    return fixtureGraph
 
+@timedStage("graph build")
+def updateGraphWeights(fixtureGraph: nx.Graph, gameRatings: np.ndarray,
+        teams: list):
+    '''
+    Updates the edge weights of a ratings graph in place from a ratings matrix,
+    whose rows and columns are in the same order as teams
+    '''
+    rows, cols = np.triu_indices(len(teams), 1)
+    for row, col, weight in zip(rows.tolist(), cols.tolist(),
+            gameRatings[rows, cols].tolist()):
+        fixtureGraph[teams[row]][teams[col]]["weight"] = weight
 
-def createFixturesFromGraph(gameRatings: nx.Graph, homeGameCounts: dict) -> pd.DataFrame:
+def getHomeGameCounts(teams: set, fixturedGames) -> dict:
     '''
-    Returns a df of fixtures, given a graph of ratings and a dict of previous home games.
+    Given a list of teams and a list of games (or a GameHistory), returns a
+    dict of how many home games each tam has had.
+    '''
+    homeCounts = asGameHistory(fixturedGames).homeCounts
+    return {team:homeCounts.get(team, 0) for team in teams}
+
+def getAwayGameCounts(teams: set, fixturedGames) -> dict:
+    '''
+    Given a list of teams and a list of games (or a GameHistory), returns a
+    dict of how many away games each team has had.
+    '''
+    awayCounts = asGameHistory(fixturedGames).awayCounts
+    return {team:awayCounts.get(team, 0) for team in teams}
+
+def getMaxWeightPairingsMilp(gameRatings, teams: list = None) -> list:
+    '''
+    Finds a maximum weight matching that pairs up as many teams as possible
+    (like maxcardinality in networkx), by solving it as a mixed integer
+    program with SciPy's compiled HiGHS solver. gameRatings is either a ratings graph,
+    whose edges are the only games that can be played, or a dense ratings
+    matrix whose rows and columns are in the same order as teams.
+    Returns a list of (teamA, teamB) pairings.
+    '''
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    from scipy.sparse import csr_matrix
+
+    if isinstance(gameRatings, nx.Graph):
+        teams = list(gameRatings.nodes)
+        index = {team:i for i, team in enumerate(teams)}
+        edges = [(index[teamA], index[teamB], weight) for teamA, teamB, weight
+                in gameRatings.edges(data="weight", default=0) if teamA != teamB]
+        rows = np.array([edge[0] for edge in edges], dtype=int)
+        cols = np.array([edge[1] for edge in edges], dtype=int)
+        weights = np.array([edge[2] for edge in edges], dtype=float)
+        # Find how many games can be played at once, as the graph may not
+        # pair up every team
+        adjacency = [set() for team in teams]
+        for row, col in zip(rows, cols):
+            adjacency[row].add(col)
+            adjacency[col].add(row)
+        unmatched = completeMatching(adjacency, [-1]*len(teams))
+        gameCount = (len(teams) - len(unmatched))//2
+    else:
+        rows, cols = np.triu_indices(len(teams), 1)
+        weights = gameRatings[rows, cols]
+        gameCount = len(teams)//2
+    if gameCount == 0:
+        return []
+
+    # One variable per game, each team can play at most one game, and as
+    # many games as possible are played
+    edgeIndex = np.arange(len(weights))
+    incidence = csr_matrix((np.ones(2*len(weights)),
+            (np.concatenate([rows, cols]), np.concatenate([edgeIndex, edgeIndex]))),
+            shape=(len(teams), len(weights)))
+    constraints = [LinearConstraint(incidence, 0, 1),
+            LinearConstraint(np.ones((1, len(weights))), gameCount, gameCount)]
+    result = milp(-weights, integrality=np.ones(len(weights)),
+            bounds=Bounds(0, 1), constraints=constraints,
+            options={"mip_rel_gap": 0})
+    if not result.success:
+        raise RuntimeError("Matching solver failed: %s" % result.message)
+
+    chosen = np.flatnonzero(result.x > 0.5)
+    return [(teams[rows[edge]], teams[cols[edge]]) for edge in chosen]
+
+MATCHING_BACKENDS = ("networkx", "milp")
+
+@timedStage("matching")
+def getMaxWeightPairings(gameRatings, teams: list = None,
+        backend: str = "networkx") -> list:
+    '''
+    Returns the maximally weighted set of pairings as a list of
+    (teamA, teamB) tuples. gameRatings is either a ratings graph, or a ratings
+    matrix whose rows and columns are in the same order as teams.
+    The backend is one of:
+      - "networkx": networkx.max_weight_matching, the reference implementation
+      - "milp": an integer program solved by SciPy's HiGHS solver. It finds
+        matchings of the same weight, but it is not reliably faster: it is
+        slower than networkx on some divisions of 60 to 300 teams. Time both
+        on your league sizes with fixturelib_bench.py before switching.
+    '''
+    if backend not in MATCHING_BACKENDS:
+        raise ValueError("Unknown matching backend %r, expected one of %s"
+                % (backend, ", ".join(MATCHING_BACKENDS)))
+
+    if backend == "networkx":
+        if not isinstance(gameRatings, nx.Graph):
+            gameRatings = createGraphFromMatrix(gameRatings, teams)
+        # Insist on pairing up every team we can, otherwise games whose
+        # rating has been reduced to zero could leave teams without a game.
+        # The matching comes back as a set, so sort it to keep the order of
+        # the pairings the same from run to run.
+        return sorted(tuple(sorted(pairing)) for pairing in
+                nx.max_weight_matching(gameRatings, maxcardinality=True))
+
+    return getMaxWeightPairingsMilp(gameRatings, teams)
+
+FIXTURE_COLUMNS = ['Home Team','Away Team','Game Code']
+
+def orientPairings(pairings: list, homeGameCounts: dict) -> list:
+    '''
+    Decides which team is at home for each of a list of (teamA, teamB)
+    pairings, returning a list of (homeTeam, awayTeam) games. The team that
+    has had fewer home games is at home.
+    '''
+    games = []
+    for teamA, teamB in pairings:
+        if homeGameCounts.get(teamA, 0) > homeGameCounts.get(teamB, 0):
+            games.append((teamB, teamA))
+        else:
+            games.append((teamA, teamB))
+    return games
+
+def createFixtureDataFrame(games: list) -> pd.DataFrame:
+    '''
+    Builds a df of fixtures from a list of (homeTeam, awayTeam) games in one go
+    '''
+    return pd.DataFrame([(homeTeam, awayTeam, homeTeam + " vs " + awayTeam)
+            for homeTeam, awayTeam in games], columns=FIXTURE_COLUMNS)
+
+def createFixturesFromPairings(pairings: list, homeGameCounts: dict) -> pd.DataFrame:
+    '''
+    Returns a df of fixtures, given a list of (teamA, teamB) pairings and a dict
+    of previous home games.
     We use the homeGameCounts to try and even out the home/away split, so that all teams
     should get approximately the same number of home/away games over a season.
     '''
-    rawPairings = nx.max_weight_matching(gameRatings)
     homeGameCounts["Bye Team"] = 0
-    fixture = pd.DataFrame(columns=['Home Team','Away Team','Game Code'])
-    row = 0
+    return createFixtureDataFrame(orientPairings(pairings, homeGameCounts))
+
+def createFixturesFromGraph(gameRatings: nx.Graph, homeGameCounts: dict,
+        backend: str = "networkx") -> pd.DataFrame:
+    '''
+    Returns a df of fixtures, given a graph of ratings and a dict of previous home games.
+    See getMaxWeightPairings() for the available matching backends.
+    '''
+    rawPairings = getMaxWeightPairings(gameRatings, backend = backend)
+    return createFixturesFromPairings(rawPairings, homeGameCounts)
+
+def createRemainingGraph(counts: np.ndarray, rematchesAllowed: int) -> (list, np.ndarray):
+    '''
+    Returns the graph of games that can still be played without breaking
+    rematchesAllowed, given an n x n matrix of how often each pair of teams has
+    played (see GameHistory.getCountMatrix()). The graph is returned as a list
+    of the set of possible opponents for each team, and a matrix of how many
+    more times each pair can play.
+    '''
+    capacity = rematchesAllowed + 1 - counts.astype(int)
+    np.fill_diagonal(capacity, 0)
+    adjacency = [set(np.nonzero(capacity[index] > 0)[0].tolist())
+            for index in range(len(counts))]
+    return adjacency, capacity
+
+def playMatching(adjacency: list, capacity: np.ndarray, mate: list):
+    '''
+    Removes a round of games, given as a list of each team's opponent, from
+    the remaining graph (see createRemainingGraph())
+    '''
+    for indexA, indexB in enumerate(mate):
+        if indexA < indexB:
+            capacity[indexA, indexB] -= 1
+            capacity[indexB, indexA] -= 1
+            if capacity[indexA, indexB] <= 0:
+                adjacency[indexA].discard(indexB)
+                adjacency[indexB].discard(indexA)
+
+def augmentMatching(adjacency: list, mate: list, root: int) -> bool:
+    '''
+    Searches for an augmenting path from the unmatched team root, using
+    Edmonds' blossom algorithm, and flips it so root is matched. mate is the
+    list of each team's opponent (-1 if unmatched), and is updated in place.
+    Returns False if there is no augmenting path from root.
+    '''
+    teamCount = len(adjacency)
+    parent = [-1]*teamCount
+    base = list(range(teamCount))
+    used = [False]*teamCount
+    used[root] = True
+    queue = [root]
+
+    def findCommonBase(indexA, indexB):
+        onPath = [False]*teamCount
+        while True:
+            indexA = base[indexA]
+            onPath[indexA] = True
+            if mate[indexA] == -1:
+                break
+            indexA = parent[mate[indexA]]
+        while True:
+            indexB = base[indexB]
+            if onPath[indexB]:
+                return indexB
+            indexB = parent[mate[indexB]]
+
+    def markBlossom(index, blossomBase, child, inBlossom):
+        while base[index] != blossomBase:
+            inBlossom[base[index]] = inBlossom[base[mate[index]]] = True
+            parent[index] = child
+            child = mate[index]
+            index = parent[mate[index]]
+
+    head = 0
+    while head < len(queue):
+        index = queue[head]
+        head += 1
+        for opponent in adjacency[index]:
+            if base[index] == base[opponent] or mate[index] == opponent:
+                continue
+            if opponent == root or (mate[opponent] != -1
+                    and parent[mate[opponent]] != -1):
+                # Found an odd cycle, so shrink it into a blossom
+                blossomBase = findCommonBase(index, opponent)
+                inBlossom = [False]*teamCount
+                markBlossom(index, blossomBase, opponent, inBlossom)
+                markBlossom(opponent, blossomBase, index, inBlossom)
+                for other in range(teamCount):
+                    if inBlossom[base[other]]:
+                        base[other] = blossomBase
+                        if not used[other]:
+                            used[other] = True
+                            queue.append(other)
+            elif parent[opponent] == -1:
+                parent[opponent] = index
+                if mate[opponent] == -1:
+                    # Flip the matched and unmatched games along the path
+                    while opponent != -1:
+                        previous = parent[opponent]
+                        nextOpponent = mate[previous]
+                        mate[opponent] = previous
+                        mate[previous] = opponent
+                        opponent = nextOpponent
+                    return True
+                used[mate[opponent]] = True
+                queue.append(mate[opponent])
+    return False
+
+def completeMatching(adjacency: list, mate: list) -> list:
+    '''
+    Grows a partial matching, given as a list of each team's opponent (-1 if
+    unmatched), into a maximum matching of the graph by augmenting from each
+    unmatched team. Games that are no longer in the graph are dropped first,
+    so a matching from a slightly different graph can be repaired rather than
+    found from scratch. Returns the teams left unmatched, which is empty if
+    the matching is perfect.
+    '''
+    for index, opponent in enumerate(mate):
+        if opponent != -1 and opponent not in adjacency[index]:
+            mate[index] = -1
+            mate[opponent] = -1
+    for index in range(len(mate)):
+        if mate[index] == -1:
+            augmentMatching(adjacency, mate, index)
+    return [index for index, opponent in enumerate(mate) if opponent == -1]
 
-    for match in rawPairings:
-        teamA = match[0]
-        teamB = match[1]
+def getFutureMatchings(adjacency: list, capacity: np.ndarray,
+        rounds: int) -> list:
+    '''
+    Finds up to rounds perfect matchings that can be played one after the
+    other in the remaining graph, stopping at the first round that can't be
+    completed. This is greedy, so it may stop early when a different choice of
+    earlier rounds would have let more be played.
+    The graph is left as it was.
+    '''
+    adjacency = [set(opponents) for opponents in adjacency]
+    capacity = capacity.copy()
+    matchings = []
+    for roundIndex in range(rounds):
+        mate = [-1]*len(adjacency)
+        if completeMatching(adjacency, mate):
+            break
+        playMatching(adjacency, capacity, mate)
+        matchings.append(mate)
+    return matchings
 
-        if homeGameCounts[teamA] > homeGameCounts[teamB]:
-            homeTeam = teamB
-            awayTeam = teamA
+def countFeasibleRounds(adjacency: list, capacity: np.ndarray, mate: list,
+        futureMatchings: list, rounds: int) -> (int, list):
+    '''
+    Counts how many of the next rounds could still be played, up to rounds,
+    if the round given by mate is played now. Each future round is repaired
+    from the matching in futureMatchings (see getFutureMatchings()) rather
+    than found from scratch. Returns the count, and the teams that were left
+    without an opponent in the first round that couldn't be played.
+    '''
+    adjacency = [set(opponents) for opponents in adjacency]
+    capacity = capacity.copy()
+    playMatching(adjacency, capacity, mate)
+    for roundIndex in range(rounds):
+        if roundIndex < len(futureMatchings):
+            futureMate = list(futureMatchings[roundIndex])
         else:
-            homeTeam = teamA
-            awayTeam = teamB
-        fixture.loc[row,'Home Team'] = homeTeam
-        fixture.loc[row,'Away Team'] = awayTeam
-        fixture.loc[row,'Game Code'] = homeTeam + " vs " + awayTeam
-        row+=1
-    return fixture
+            futureMate = [-1]*len(adjacency)
+        unmatched = completeMatching(adjacency, futureMate)
+        if unmatched:
+            return roundIndex, unmatched
+        playMatching(adjacency, capacity, futureMate)
+    return rounds, []
 
 def fixtureSingleRound(teams: set, elos: dict, fixtured: list, requested: list,
-        antiRequested: list, rematchesAllowed: int) -> pd.DataFrame:
+        antiRequested: list, rematchesAllowed: int,
+        backend: str = "networkx", retryPenalty: float = 10,
+        rng = None, topK: int = None, lookahead: int = 0,
+        maxCandidates: int = 20) -> pd.DataFrame:
+    '''
+    Fixture a single round, returning a df of fixtures. See
+    fixtureSingleRoundGames() for the details.
+    '''
+    return createFixtureDataFrame(fixtureSingleRoundGames(teams, elos, fixtured,
+            requested, antiRequested, rematchesAllowed, backend, retryPenalty,
+            rng, topK, lookahead, maxCandidates))
+
+def fixtureSingleRoundGames(teams: set, elos: dict, fixtured, requested,
+        antiRequested, rematchesAllowed: int, backend: str = "networkx",
+        retryPenalty: float = 10, rng = None, topK: int = None,
+        lookahead: int = 0, maxCandidates: int = 20) -> list:
+    '''
+    Fixture a single round, returning a list of (homeTeam, awayTeam) games.
+    The game lists can be lists of game codes or
+    GameHistory objects. See getMaxWeightPairings() for the available
+    matching backends.
+    If the best fixture has too many rematches, the Elos are altered slightly
+    and only the Elo part of the game ratings is recomputed. The games that
+    broke the rematch limit also have their rating reduced by retryPenalty, so
+    they are less likely to be picked on the next attempt. Pass
+    retryPenalty = 0 to only alter the Elos.
+    The Elos are altered with rng, a random generator or seed (see getRng()),
+    and the altered Elos are written back to elos.
+    If topK is given with the networkx backend, only each team's topK best
+    rated games are considered, see getCandidatePairings(). This is much
+    quicker for big divisions, but may miss the very best fixture.
+    If lookahead is given, each fixture that passes the rematch check is
+    also checked to make sure the next lookahead rounds could still be played
+    without breaking rematchesAllowed (see countFeasibleRounds()). A fixture
+    that would leave a dead end has its games with the stranded teams reduced
+    by retryPenalty, and the next best fixture is tried, up to maxCandidates
+    fixtures. If none of them clear every round, the one that clears the most
+    is used. This raises a FixtureError straight away if this round can't be
+    played at all, rather than retrying forever.
+    The teams fixtured are the keys of elos, which are held in a League while
+    the round is fixtured (see fixtureLeagueRound()).
     '''
-    Fixture a single round
+    league = League(elos, fixtured = fixtured, requested = requested,
+            antiRequested = antiRequested)
+    games = fixtureLeagueRound(league, rematchesAllowed, backend, retryPenalty,
+            rng, topK, lookahead, maxCandidates)
+    elos.update(league.getEloDict())
+    return league.getNames(games)
+
+def fixtureLeagueRound(league: League, rematchesAllowed: int,
+        backend: str = "networkx", retryPenalty: float = 10, rng = None,
+        topK: int = None, lookahead: int = 0, maxCandidates: int = 20) -> list:
+    '''
+    Fixture a single round of a League, returning a list of (homeId, awayId)
+    games. See fixtureSingleRoundGames() for the details. The Elos of the
+    league are altered in place on retries, but no games are added to it.
     '''
+    rng = getRng(rng)
+    teamIds = list(range(len(league.teams)))
+    # The history part of the ratings doesn't change between attempts, so only
+    # work it out once
+    historyRatings = league.getHistoryRatings()
+    gameRatingsGraph = None
+
+    if lookahead > 0:
+        remainingGraph, remainingCapacity = createRemainingGraph(
+                league.gameCounts, rematchesAllowed)
+        futureMatchings = getFutureMatchings(remainingGraph, remainingCapacity,
+                lookahead + 1)
+        if not futureMatchings:
+            raise FixtureError("No fixture of %s meets rematchesAllowed = %i"
+                    %(", ".join(league.teams), rematchesAllowed))
+        bestPairings = None
+        bestRounds = -1
+        candidates = 0
+
     complete = False
     while not complete:
-        gameRatingsGraph = createGameRatingsGraph(fixtured, requested,
-                antiRequested, elos)
-        homeGameCounts = getHomeGameCounts(teams, fixtured)
-        fixtures = createFixturesFromGraph(gameRatingsGraph, homeGameCounts)
+        attemptStart = time.perf_counter()
+        gameRatings = combineRatingsMatrices(historyRatings,
+                getEloRatings(league.elos))
+        if topK is not None and backend == "networkx":
+            pairings = getCandidatePairings(gameRatings, teamIds, topK)
+        elif backend == "networkx":
+            if gameRatingsGraph is None:
+                gameRatingsGraph = createGraphFromMatrix(gameRatings, teamIds)
+            else:
+                updateGraphWeights(gameRatingsGraph, gameRatings, teamIds)
+            pairings = getMaxWeightPairings(gameRatingsGraph, backend = backend)
+        else:
+            pairings = getMaxWeightPairings(gameRatings, teamIds, backend)
 
         # Check to see if any games have been fixtured previously
-        maxRepeats = 0
-        for row in range(len(fixtures.index)):
-            homeT = fixtures.loc[row,'Home Team']
-            awayT = fixtures.loc[row,'Away Team']
-            repeats = checkIfGameInList(homeT, awayT, fixtures)[1]
-            maxRepeats = max(repeats, maxRepeats)
+        offendingPairings = [(idA, idB) for idA, idB in pairings
+                if league.gameCounts[idA, idB] > rematchesAllowed]
 
-        if maxRepeats <= rematchesAllowed:
+        if not offendingPairings and lookahead > 0:
+            mate = [-1]*len(teamIds)
+            for idA, idB in pairings:
+                mate[idA] = idB
+                mate[idB] = idA
+            feasibleRounds, unmatched = countFeasibleRounds(remainingGraph,
+                    remainingCapacity, mate, futureMatchings[1:], lookahead)
+            instrumentation.count("lookaheadCandidates")
+            candidates += 1
+            if feasibleRounds > bestRounds:
+                bestPairings, bestRounds = pairings, feasibleRounds
+            if feasibleRounds == lookahead:
+                complete = True
+            elif candidates >= maxCandidates:
+                print("Warning: Only %i of the next %i rounds can be fixtured "
+                        "after this one" %(bestRounds, lookahead))
+                pairings = bestPairings
+                complete = True
+            else:
+                # Steer away from the games that leave teams stranded later
+                for idA, idB in {tuple(sorted((teamId, mate[teamId])))
+                        for teamId in unmatched}:
+                    historyRatings[idA, idB] -= retryPenalty
+                    historyRatings[idB, idA] -= retryPenalty
+        elif not offendingPairings:
             complete = True
         else:
             print("Error: Could not find fixture within maxRepeats")
             print("Slightly altering Elos to try and get a different solution")
-            for team in teams:
-                currElo = elos[team]
-                factor = random.uniform(-2.5,2.5)
-                elos[team] = currElo + factor
-    return fixtures
+            league.elos += [rng.uniform(-2.5,2.5) for teamId in teamIds]
+            for idA, idB in offendingPairings:
+                historyRatings[idA, idB] -= retryPenalty
+                historyRatings[idB, idA] -= retryPenalty
+            instrumentation.count("retries")
+            instrumentation.addStageTime("retry",
+                    time.perf_counter() - attemptStart)
+
+    return league.orientPairings(pairings)
 
-def findByeTeam(fixture: pd.DataFrame) -> str:
+def findByeTeam(fixture) -> str:
     '''
     Given a fixture with a bye team in it, return the team that has been
-    allocated a bye.
+    allocated a bye. The fixture can be a df or a list of
+    (homeTeam, awayTeam) games.
     '''
+    if isinstance(fixture, list):
+        for homeTeam, awayTeam in fixture:
+            if homeTeam == "Bye Team":
+                return awayTeam
+            if awayTeam == "Bye Team":
+                return homeTeam
 
     byeRow = fixture[fixture == "Bye Team"].dropna(how = "all").index[0]
     byeCol = fixture[fixture == "Bye Team"].dropna(how = "all",axis = 1).columns[0]
@@ -287,76 +1760,481 @@ def findByeTeam(fixture: pd.DataFrame) -> str:
     byeTeam = fixture.loc[byeRow,byeTeamCol]
     return byeTeam
 
+def fixtureDoubleRoundExact(teams: set, elos: dict, fixtured, requested,
+        antiRequested, rematchesAllowed: int, timeLimit: float = 60) -> list:
+    '''
+    Fixture two rounds at once for a league with an odd number of teams,
+    solving both rounds as one optimisation rather than one after the other.
+    Returns a list of (homeTeam, awayTeam) games: the first round, then the
+    second round, then the game between the two teams that had a bye.
+    Across the two rounds every team plays exactly twice, so the games form
+    cycles of teams. We find the highest rated set of games where each team
+    sits out exactly one round between the two bye teams, no pair of teams
+    plays twice and no game goes over rematchesAllowed, as a mixed integer
+    program solved by SciPy's HiGHS solver. The result is deterministic, and
+    the solver gives up after timeLimit seconds, returning the best fixture
+    found so far.
+    Raises a FixtureError if no such fixture exists.
+    '''
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    from scipy.sparse import csr_matrix, identity, hstack
+
+    # Sort the teams, so the same league always gives the same problem
+    teamList = sorted(teams)
+    teamCount = len(teamList)
+    fixturedHistory = asGameHistory(fixtured)
+    gameRatings = createGameRatingsMatrix(teamList, elos, fixturedHistory,
+            requested, antiRequested)
+    rows, cols = np.triu_indices(teamCount, 1)
+    gameCount = len(rows)
+    weights = gameRatings[rows, cols]
+    allowed = fixturedHistory.getCountMatrix(teamList)[rows, cols] <= rematchesAllowed
+
+    # Variables are, in order: whether each game is in round 1, in round 2 or
+    # is the bye game, then whether each team has the bye in round 1 or 2
+    edgeIndex = np.arange(gameCount)
+    incidence = csr_matrix((np.ones(2*gameCount),
+            (np.concatenate([rows, cols]), np.concatenate([edgeIndex, edgeIndex]))),
+            shape=(teamCount, gameCount))
+    teamIdentity = identity(teamCount, format='csr')
+    gameIdentity = identity(gameCount, format='csr')
+    teamZeros = csr_matrix((teamCount, teamCount))
+    teamGameZeros = csr_matrix((teamCount, gameCount))
+    teamOnes = csr_matrix(np.ones((1, teamCount)))
+    constraints = [
+        # Every team plays or has the bye in round 1, and the same in round 2
+        LinearConstraint(hstack([incidence, teamGameZeros, teamGameZeros,
+            teamIdentity, teamZeros]), 1, 1),
+        LinearConstraint(hstack([teamGameZeros, incidence, teamGameZeros,
+            teamZeros, teamIdentity]), 1, 1),
+        # Exactly one team has the bye in each round
+        LinearConstraint(hstack([csr_matrix((1, 3*gameCount)), teamOnes,
+            csr_matrix((1, teamCount))]), 1, 1),
+        LinearConstraint(hstack([csr_matrix((1, 3*gameCount + teamCount)),
+            teamOnes]), 1, 1),
+        # The bye game is between the two teams that had a bye
+        LinearConstraint(hstack([teamGameZeros, teamGameZeros, incidence,
+            -teamIdentity, -teamIdentity]), 0, 0),
+        # No pair of teams plays more than once across the two rounds
+        LinearConstraint(hstack([gameIdentity, gameIdentity, gameIdentity,
+            csr_matrix((gameCount, 2*teamCount))]), 0, 1),
+    ]
+    upperBounds = np.concatenate([np.tile(allowed.astype(float), 3),
+            np.ones(2*teamCount)])
+    objective = -np.concatenate([weights, weights, weights, np.zeros(2*teamCount)])
+    result = milp(objective, integrality=np.ones(len(objective)),
+            bounds=Bounds(0, upperBounds), constraints=constraints,
+            options={"time_limit":timeLimit})
+    if result.x is None:
+        raise FixtureError("Could not find a double round fixture with at "
+                "most %i rematches: %s" % (rematchesAllowed, result.message))
+
+    chosen = result.x > 0.5
+    pairingsRd1 = [(teamList[rows[edge]], teamList[cols[edge]])
+            for edge in np.flatnonzero(chosen[:gameCount])]
+    pairingsRd2 = [(teamList[rows[edge]], teamList[cols[edge]])
+            for edge in np.flatnonzero(chosen[gameCount:2*gameCount])]
+    byePairing = [(teamList[rows[edge]], teamList[cols[edge]])
+            for edge in np.flatnonzero(chosen[2*gameCount:3*gameCount])]
+
+    # Decide home and away round by round, so the counts carry over
+    homeGameCounts = getHomeGameCounts(teams, fixturedHistory)
+    games = []
+    for pairings in (pairingsRd1, pairingsRd2, byePairing):
+        roundGames = orientPairings(pairings, homeGameCounts)
+        for homeTeam, awayTeam in roundGames:
+            homeGameCounts[homeTeam] += 1
+        games.extend(roundGames)
+    return games
+
+DOUBLE_ROUND_METHODS = ("exact", "retry")
+
 def fixtureDoubleRound(teams: set, elos: dict, fixtured: list, requested: list,
-        antiRequested: list, rematchesAllowed: int) -> pd.DataFrame:
+        antiRequested: list, rematchesAllowed: int,
+        backend: str = "networkx", method: str = "exact",
+        timeLimit: float = 60, rng = None) -> pd.DataFrame:
     '''
     Fixture two rounds at once. This is used when there are an odd number of
     teams in the league, as we can avoid byes by fixturing two rounds at once.
+    fixtured can be a list of game codes or a GameHistory.
+    The method is one of:
+      - "exact": solve both rounds together with fixtureDoubleRoundExact().
+        This raises a FixtureError if no fixture meets rematchesAllowed.
+        The backend is not used.
+      - "retry": fixture the rounds one after the other with a "Bye Team",
+        randomly altering the Elos until the rematch check passes. The
+        random choices are made with rng, a random generator or seed (see
+        getRng()).
     '''
+    if method not in DOUBLE_ROUND_METHODS:
+        raise ValueError("Unknown double round method %r, expected one of %s"
+                % (method, ", ".join(DOUBLE_ROUND_METHODS)))
+    if method == "exact":
+        return createFixtureDataFrame(fixtureDoubleRoundExact(teams, elos,
+                fixtured, requested, antiRequested, rematchesAllowed, timeLimit))
+
+    # Each attempt stages its games on top of the fixtured games and rolls them
+    # back afterwards, so neither failed attempts nor the final fixture change
+    # the history (or the list) that was passed in
+    fixturedHistory = asGameHistory(fixtured)
+    rng = getRng(rng)
     complete = False
 
     while not complete:
-        previousFixtured = copy.deepcopy(fixtured)
-        elos["Bye Team"] = random.choice(list(elos.values()))
-
-        fixtureRd1 = fixtureSingleRound(teams,elos,fixtured, requested,
-                antiRequested,rematchesAllowed)
+        attemptStart = time.perf_counter()
+        elos["Bye Team"] = rng.choice([elos[team] for team in sorted(elos)])
 
-        fixtured.extend(list(fixtureRd1['Game Code']))
+        gamesRd1 = fixtureSingleRoundGames(teams,elos,fixturedHistory, requested,
+                antiRequested,rematchesAllowed, backend, rng = rng)
 
-        fixtureRd2 = fixtureSingleRound(teams, elos, fixtured, requested,
-                antiRequested, rematchesAllowed)
+        fixturedHistory.begin()
+        try:
+            for homeTeam, awayTeam in gamesRd1:
+                fixturedHistory.addGame(homeTeam, awayTeam)
+            gamesRd2 = fixtureSingleRoundGames(teams, elos, fixturedHistory,
+                    requested, antiRequested, rematchesAllowed, backend,
+                    rng = rng)
+        finally:
+            fixturedHistory.rollback()
 
-        byeTeam1 = findByeTeam(fixtureRd1)
-        byeTeam2 = findByeTeam(fixtureRd2)
+        byeTeam1 = findByeTeam(gamesRd1)
+        byeTeam2 = findByeTeam(gamesRd2)
 
         # Remove the bye team games from the fixtures
-        fixtureRd1 = fixtureRd1[fixtureRd1['Home Team'] != "Bye Team"]
-        fixtureRd1 = fixtureRd1[fixtureRd1['Away Team'] != "Bye Team"]
-        fixtureRd2 = fixtureRd2[fixtureRd2['Home Team'] != "Bye Team"]
-        fixtureRd2 = fixtureRd2[fixtureRd2['Away Team'] != "Bye Team"]
-
-        previousFixtured.extend(list(fixtureRd1['Game Code']))
-        previousFixtured.extend(list(fixtureRd2['Game Code']))
-
-        # Fixture the two bye teams against each other,
-        homeCount = getHomeGameCounts(teams,previousFixtured)
-        if homeCount[byeTeam1] > homeCount[byeTeam2]:
-            homeByeTeam = byeTeam2
-            awayByeTeam = byeTeam1
-        else:
-            homeByeTeam = byeTeam1
-            awayByeTeam = byeTeam2
+        totalGames = [game for game in gamesRd1 + gamesRd2
+                if "Bye Team" not in game]
 
-        totalFixture = pd.concat([fixtureRd1,fixtureRd2])
-        totalFixture.reset_index(drop=True,inplace=True)
-        row = len(totalFixture.index)
+        fixturedHistory.begin()
+        try:
+            for homeTeam, awayTeam in totalGames:
+                fixturedHistory.addGame(homeTeam, awayTeam)
 
-        totalFixture.loc[row,'Home Team'] = homeByeTeam
-        totalFixture.loc[row,'Away Team'] = awayByeTeam
-        totalFixture.loc[row,'Game Code'] = homeByeTeam + " vs " + awayByeTeam
-
-        # Check if we are within the allowable rematches
-        maxRepeats = 0
-        for row in range(len(totalFixture.index)):
-           homeT = totalFixture.loc[row,'Home Team']
-           awayT = totalFixture.loc[row,'Away Team']
-           repeats = checkIfGameInList(homeT, awayT, previousFixtured)[1] - 1
-           maxRepeats = max(maxRepeats, repeats)
+            # Fixture the two bye teams against each other,
+            homeCount = getHomeGameCounts(teams,fixturedHistory)
+            if homeCount[byeTeam1] > homeCount[byeTeam2]:
+                homeByeTeam = byeTeam2
+                awayByeTeam = byeTeam1
+            else:
+                homeByeTeam = byeTeam1
+                awayByeTeam = byeTeam2
+            fixturedHistory.addGame(homeByeTeam, awayByeTeam)
+            totalGames.append((homeByeTeam, awayByeTeam))
 
+            # Check if we are within the allowable rematches
+            maxRepeats = 0
+            for homeT, awayT in totalGames:
+               repeats = fixturedHistory.count(homeT, awayT) - 1
+               maxRepeats = max(maxRepeats, repeats)
+        finally:
+            fixturedHistory.rollback()
 
         if maxRepeats <= rematchesAllowed:
            complete = True
         else:
            print("Error: Could not find fixture within maxRepeats")
            print("Slightly altering Elos to try and get a different solution")
-           for team in teams:
+           for team in sorted(teams):
                currElo = elos[team]
-               factor = random.uniform(-10,10)
+               factor = rng.uniform(-10,10)
                elos[team] = currElo + factor
+           instrumentation.count("retries")
+           instrumentation.addStageTime("retry",
+                   time.perf_counter() - attemptStart)
 
-    return totalFixture
+    return createFixtureDataFrame(totalGames)
 
+def projectElos(elos: dict, games: list, kValues: dict, rng = None) -> dict:
+    '''
+    Projects Elos forward over a list of (homeTeam, awayTeam) games that
+    haven't been played yet. The winner of each game is drawn at random from
+    the expected outcome, and the Elos are updated as if the winner had taken
+    every point. The winners are drawn with rng, a random generator or seed
+    (see getRng()). Returns the dict of (updated) Elos.
+    '''
+    rng = getRng(rng)
+    for homeTeam, awayTeam in games:
+        homeElo = elos[homeTeam]
+        awayElo = elos[awayTeam]
+        homeExpected, awayExpected = getExpectedOutcome(homeElo, awayElo)
+        homeOutcome = 1.0 if rng.random() < homeExpected else 0.0
+        elos[homeTeam] = getDeviation(homeExpected, homeOutcome, homeElo,
+                kValues[homeTeam])
+        elos[awayTeam] = getDeviation(awayExpected, 1 - homeOutcome, awayElo,
+                kValues[awayTeam])
+    return elos
+
+def fixtureSeason(teams: set, elos: dict, fixtured, requested, antiRequested,
+        rematchesAllowed: int, firstRound: int, roundCount: int,
+        kValues: dict = None, backend: str = "networkx",
+        rng = None, lookahead: int = 0, doubleRoundMethod: str = "exact",
+        timeLimit: float = 60) -> pd.DataFrame:
+    '''
+    Fixture a block of rounds (up to a whole season) in one go, returning a df
+    of fixtures with a "Round" column. The teams are held in a League, and
+    each round is added to it before the next round is fixtured. If kValues
+    are given, the Elos are projected forward over each round (see
+    League.projectElos()), otherwise they are left as they are.
+    Leagues with an odd number of teams are fixtured two rounds at a time with
+    fixtureDoubleRound(), and those rounds are labelled like "3-4". Their
+    double rounds always start on an odd round (as in fixtureDivision()), so
+    for an odd league firstRound must be odd and roundCount even, otherwise a
+    ValueError is raised. doubleRoundMethod and timeLimit are passed on to
+    fixtureDoubleRound().
+    All the random choices are made with rng, a random generator or seed (see
+    getRng()). The passed Elos and game lists are not changed.
+    If lookahead is given, each single round is checked to make sure that
+    many more rounds could still be played after it, up to the end of the
+    block (see fixtureSingleRoundGames()).
+    '''
+    if len(teams)%2 == 1 and (firstRound%2 == 0 or roundCount%2 == 1):
+        raise ValueError("Leagues with an odd number of teams are fixtured in "
+                "double rounds starting on odd rounds, so %i rounds from round "
+                "%i can't be fixtured" %(roundCount, firstRound))
+    rng = getRng(rng)
+    league = League(elos, kValues, fixtured, requested, antiRequested)
+    requestedHistory = asGameHistory(requested)
+    antiRequestedHistory = asGameHistory(antiRequested)
+
+    rows = []
+    roundNumber = firstRound
+    lastRound = firstRound + roundCount - 1
+    while roundNumber <= lastRound:
+        if len(teams)%2 == 0:
+            roundLabel = str(roundNumber)
+            games = fixtureLeagueRound(league, rematchesAllowed, backend,
+                    rng = rng, lookahead = min(lookahead, lastRound - roundNumber))
+            roundNumber += 1
+        else:
+            roundLabel = "%i-%i" %(roundNumber, roundNumber+1)
+            fixture = fixtureDoubleRound(teams, league.getEloDict(),
+                    league.getGameHistory(), requestedHistory,
+                    antiRequestedHistory, rematchesAllowed, backend,
+                    doubleRoundMethod, timeLimit, rng)
+            games = league.getIds(zip(fixture['Home Team'], fixture['Away Team']))
+            roundNumber += 2
+
+        league.addGames(games)
+        for homeTeam, awayTeam in league.getNames(games):
+            rows.append((roundLabel, homeTeam, awayTeam,
+                homeTeam + " vs " + awayTeam))
+        if kValues is not None:
+            league.projectElos(games, rng)
+
+    return pd.DataFrame(rows, columns=['Round'] + FIXTURE_COLUMNS)
+
+def fixtureDivision(division: dict):
+    '''
+    Replays the results and fixtures the next round (or rounds) of a single
+    division. The division is a dict with the keys:
+      - "elos": the starting Elos of the teams, keyed by team name
+      - "kValues": the K values of the teams, keyed by team name
+      - "results": a df of results to update the Elos with (optional)
+      - "fixtured", "requested", "antiRequested": lists of game codes
+        (optional, empty by default)
+      - "rematchesAllowed": (optional, 0 by default)
+      - "roundNumber": the round to fixture
+      - "roundCount": how many rounds to fixture with fixtureSeason()
+        (optional, 1 by default)
+      - "backend": the matching backend (optional, "networkx" by default)
+      - "seed": the seed for any random choices (optional, unseeded by default)
+      - "topK": only consider each team's topK best rated games in single
+        rounds (optional, see fixtureSingleRoundGames())
+      - "lookahead": how many later rounds single rounds must leave playable
+        (optional, 0 by default, see fixtureSingleRoundGames())
+    Returns a df of fixtures, or None if the division has an odd number of
+    teams and the round was fixtured with the one before it.
+    '''
+    elos = dict(division["elos"])
+    kValues = division["kValues"]
+    teams = set(elos.keys())
+    fixtured = list(division.get("fixtured", []))
+    requested = division.get("requested", [])
+    antiRequested = division.get("antiRequested", [])
+    rematchesAllowed = division.get("rematchesAllowed", 0)
+    roundNumber = division["roundNumber"]
+    roundCount = division.get("roundCount", 1)
+    backend = division.get("backend", "networkx")
+    rng = getRng(division.get("seed"))
+    topK = division.get("topK")
+    lookahead = division.get("lookahead", 0)
+
+    if division.get("results") is not None:
+        elos = updateElosFromResults(elos, division["results"], kValues)
+
+    if roundCount > 1:
+        return fixtureSeason(teams, elos, fixtured, requested, antiRequested,
+                rematchesAllowed, roundNumber, roundCount, kValues, backend, rng,
+                lookahead)
+    if len(teams)%2 == 0:
+        return fixtureSingleRound(teams, elos, fixtured, requested,
+                antiRequested, rematchesAllowed, backend, rng = rng,
+                topK = topK, lookahead = lookahead)
+    if roundNumber%2 == 1:
+        return fixtureDoubleRound(teams, elos, fixtured, requested,
+                antiRequested, rematchesAllowed, backend, rng = rng)
+    return None
+
+def fixtureDivisionWithReport(division: dict) -> (pd.DataFrame, dict):
+    '''
+    Fixtures a division in a worker process, returning the fixture along
+    with the instrumentation report of just this division
+    '''
+    instrumentation.reset()
+    fixture = fixtureDivision(division)
+    return (fixture, instrumentation.report())
+
+def fixtureDivisions(divisions: dict, workers: int = None) -> dict:
+    '''
+    Fixtures several divisions at once, returning a dict of fixtures keyed by
+    division name. divisions is a dict of division name to the division
+    config described in fixtureDivision(). The divisions share nothing, so
+    each one is replayed and fixtured in its own process, and each process's
+    stage times and counts are merged into this one's instrumentation. Pass
+    workers = 1 to fixture them one after the other in this process instead.
+    '''
+    if workers == 1:
+        return {name:fixtureDivision(division)
+                for name, division in divisions.items()}
 
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = {name:executor.submit(fixtureDivisionWithReport, division)
+                for name, division in divisions.items()}
+        fixtures = {}
+        for name, future in futures.items():
+            fixtures[name], report = future.result()
+            instrumentation.merge(report)
+        return fixtures
+
+def matchRound(elos: dict, fixtured, requested, antiRequested,
+        backend: str = "networkx") -> list:
+    '''
+    Rates every game between the teams in elos and returns the maximally
+    weighted list of (teamA, teamB) pairings, with no retries
+    '''
+    ratedTeams = sorted(elos.keys())
+    gameRatings = createGameRatingsMatrix(ratedTeams, elos, fixtured, requested,
+            antiRequested)
+    return getMaxWeightPairings(gameRatings, ratedTeams, backend)
+
+def getTotalRating(pairings: list, elos: dict, fixtured, requested,
+        antiRequested) -> float:
+    '''
+    Returns the total game rating of a list of (teamA, teamB) pairings
+    '''
+    fixtured = asGameHistory(fixtured)
+    requested = asGameHistory(requested)
+    antiRequested = asGameHistory(antiRequested)
+    return sum(createGameRating(teamA, teamB, elos, fixtured, requested,
+        antiRequested) for teamA, teamB in pairings)
+
+def attemptSingleRound(seed: int, teams: set, elos: dict, fixtured, requested,
+        antiRequested, rematchesAllowed: int, backend: str = "networkx"):
+    '''
+    Makes one attempt at fixturing a single round, after altering the Elos
+    slightly using a random generator seeded with seed. Returns
+    (games, totalRating, valid), where games is a list of (homeTeam, awayTeam)
+    games, totalRating is rated with the unaltered Elos and valid is whether
+    the games are within rematchesAllowed.
+    '''
+    fixtured = asGameHistory(fixtured)
+    rng = random.Random(seed)
+    alteredElos = dict(elos)
+    for team in sorted(teams):
+        alteredElos[team] += rng.uniform(-2.5,2.5)
+
+    pairings = matchRound(alteredElos, fixtured, requested, antiRequested, backend)
+    maxRepeats = max([fixtured.count(teamA, teamB) for teamA, teamB in pairings],
+            default = 0)
+    games = orientPairings(pairings, getHomeGameCounts(teams, fixtured))
+    totalRating = getTotalRating(pairings, elos, fixtured, requested,
+            antiRequested)
+    return (games, totalRating, maxRepeats <= rematchesAllowed)
+
+def attemptDoubleRound(seed: int, teams: set, elos: dict, fixtured, requested,
+        antiRequested, rematchesAllowed: int, backend: str = "networkx"):
+    '''
+    Makes one attempt at fixturing a double round with a "Bye Team", in the
+    same way as the "retry" method of fixtureDoubleRound(), using a random
+    generator seeded with seed to alter the Elos and pick the bye team's Elo.
+    Returns (games, totalRating, valid) like attemptSingleRound().
+    '''
+    fixtured = asGameHistory(fixtured)
+    rng = random.Random(seed)
+    alteredElos = dict(elos)
+    for team in sorted(teams):
+        alteredElos[team] += rng.uniform(-10,10)
+    alteredElos["Bye Team"] = rng.choice([elos[team] for team in sorted(teams)])
+
+    homeGameCounts = getHomeGameCounts(teams, fixtured)
+    games = []
+    byeTeams = []
+    fixtured.begin()
+    try:
+        for roundNumber in range(2):
+            pairings = matchRound(alteredElos, fixtured, requested,
+                    antiRequested, backend)
+            for teamA, teamB in pairings:
+                fixtured.addGame(teamA, teamB)
+            byeTeams.append(findByeTeam(pairings))
+            roundGames = orientPairings([pairing for pairing in pairings
+                if "Bye Team" not in pairing], homeGameCounts)
+            for homeTeam, awayTeam in roundGames:
+                homeGameCounts[homeTeam] += 1
+            games.extend(roundGames)
+    finally:
+        fixtured.rollback()
+    games.extend(orientPairings([tuple(byeTeams)], homeGameCounts))
+
+    newHistory = GameHistory()
+    for homeTeam, awayTeam in games:
+        newHistory.addGame(homeTeam, awayTeam)
+    maxRepeats = max(fixtured.count(homeTeam, awayTeam) +
+            newHistory.count(homeTeam, awayTeam) - 1
+            for homeTeam, awayTeam in games)
+    totalRating = getTotalRating(games, elos, fixtured, requested, antiRequested)
+    valid = maxRepeats <= rematchesAllowed and byeTeams[0] != byeTeams[1]
+    return (games, totalRating, valid)
+
+SEARCH_PICKS = ("first", "best")
+
+def searchFixtures(attemptFunction, teams: set, elos: dict, fixtured,
+        requested, antiRequested, rematchesAllowed: int, attempts: int = 8,
+        workers: int = None, seed: int = 0, pick: str = "first",
+        maxBatches: int = 100, backend: str = "networkx"):
+    '''
+    Runs batches of attempts (attemptSingleRound or attemptDoubleRound) across
+    worker processes, each with its own seed, rather than retrying one at a
+    time. Batch b uses seeds seed + b*attempts up to seed + (b+1)*attempts - 1.
+    From the first batch with any valid fixture, we pick either the "first"
+    one (lowest seed) or the "best" one (highest total rating). As the pick
+    only depends on the seeds, the same inputs always give the same result.
+    Returns (fixture, seed), where fixture is a df and seed is the one that
+    produced it; calling attemptFunction with that seed gives it again.
+    Raises a FixtureError if no batch up to maxBatches finds a valid fixture.
+    '''
+    if pick not in SEARCH_PICKS:
+        raise ValueError("Unknown pick %r, expected one of %s"
+                % (pick, ", ".join(SEARCH_PICKS)))
 
+    attempt = partial(attemptFunction, teams = teams, elos = elos,
+            fixtured = asGameHistory(fixtured).copy(),
+            requested = asGameHistory(requested),
+            antiRequested = asGameHistory(antiRequested),
+            rematchesAllowed = rematchesAllowed, backend = backend)
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        for batch in range(maxBatches):
+            seeds = list(range(seed + batch*attempts, seed + (batch+1)*attempts))
+            results = list(executor.map(attempt, seeds))
+            valid = [(totalRating, -attemptSeed, games) for attemptSeed,
+                    (games, totalRating, isValid) in zip(seeds, results) if isValid]
+            if not valid:
+                print("No valid fixture in batch %i, trying the next batch" % batch)
+                continue
+            if pick == "first":
+                chosen = max(valid, key = lambda result: result[1])
+            else:
+                chosen = max(valid, key = lambda result: result[:2])
+            return (createFixtureDataFrame(chosen[2]), -chosen[1])
 
+    raise FixtureError("Could not find a fixture with at most %i rematches in "
+            "%i attempts" % (rematchesAllowed, maxBatches*attempts))
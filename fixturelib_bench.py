@@ -0,0 +1,163 @@
+# Benchmarks for the Fixturing Library, run on synthetic leagues
+# Usage: python fixturelib_bench.py --teams 10 11 40 41 --seasons 3 > bench.json
+from fixturelib import *
+import argparse
+import statistics
+import time
+
+
+def createSyntheticLeague(teamCount: int, seasons: int, requestDensity: float,
+        antiRequestDensity: float, seed: int = 0) -> dict:
+    '''
+    Creates a synthetic league of teamCount teams with seasons worth of
+    results. Each season is teamCount - 1 rounds of random pairings, with
+    scores drawn from the expected outcome. requestDensity and
+    antiRequestDensity are the fraction of all possible games that have been
+    requested or anti-requested.
+    Returns a dict with the teams, Elos, K values, results df and the
+    fixtured, requested and anti-requested game codes.
+    '''
+    rng = random.Random(seed)
+    teams = ["Team %i" %team for team in range(teamCount)]
+    trueElos = {team:rng.gauss(1000, 150) for team in teams}
+
+    rows = []
+    for roundNumber in range(1, seasons*(teamCount - 1) + 1):
+        order = list(teams)
+        rng.shuffle(order)
+        for game in range(0, teamCount - 1, 2):
+            homeTeam, awayTeam = order[game], order[game + 1]
+            homeExpected = getExpectedOutcome(trueElos[homeTeam],
+                    trueElos[awayTeam])[0]
+            homeScore = int(round(rng.uniform(0, 2*homeExpected)*20))
+            awayScore = int(round(rng.uniform(0, 2*(1 - homeExpected))*20))
+            rows.append((roundNumber, homeTeam, awayTeam, homeScore, awayScore))
+    results = pd.DataFrame(rows, columns=RESULTS_COLUMNS)
+
+    allGames = [teamA + " vs " + teamB for index, teamA in enumerate(teams)
+            for teamB in teams[index + 1:]]
+    return {"teams":set(teams),
+            "elos":{team:1000.0 for team in teams},
+            "kValues":{team:32.0 for team in teams},
+            "results":results,
+            "fixtured":list(results['Home Team'] + " vs " + results['Away Team']),
+            "requested":rng.sample(allGames, int(requestDensity*len(allGames))),
+            "antiRequested":rng.sample(allGames,
+                int(antiRequestDensity*len(allGames)))}
+
+def timeCall(function, repeats: int) -> dict:
+    '''
+    Calls function repeats times, returning the min and median wall time in
+    seconds
+    '''
+    times = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"min":min(times), "median":statistics.median(times)}
+
+def benchmarkLeague(league: dict, repeats: int,
+        backends: list = MATCHING_BACKENDS) -> dict:
+    '''
+    Times each of the fixturing hot paths on a synthetic league, returning a
+    dict of timings keyed by function name. getMaxWeightPairings is timed on
+    the league's ratings matrix with each of the matching backends, and its
+    timings also give the total weight of the matching, so the backends can
+    be checked against each other.
+    '''
+    teams = league["teams"]
+    fixtured = league["fixtured"]
+    requested = league["requested"]
+    antiRequested = league["antiRequested"]
+    elos = updateElosFromResults(dict(league["elos"]), league["results"],
+            league["kValues"])
+    # Allow any number of rematches, so each call is a single attempt
+    rematchesAllowed = len(fixtured)
+
+    gameRatings = createGameRatingsGraph(fixtured, requested, antiRequested, elos)
+    homeGameCounts = getHomeGameCounts(teams, fixtured)
+    timings = {
+        "updateElosFromResults":timeCall(lambda: updateElosFromResults(
+            dict(league["elos"]), league["results"], league["kValues"]), repeats),
+        "createGameRatingsGraph":timeCall(lambda: createGameRatingsGraph(
+            fixtured, requested, antiRequested, elos), repeats),
+        "getHomeGameCounts":timeCall(lambda: getHomeGameCounts(teams, fixtured),
+            repeats),
+        "createFixturesFromGraph":timeCall(lambda: createFixturesFromGraph(
+            gameRatings, dict(homeGameCounts)), repeats),
+    }
+    if len(teams)%2 == 0:
+        timings["fixtureSingleRound"] = timeCall(lambda: fixtureSingleRound(
+            teams, dict(elos), fixtured, requested, antiRequested,
+            rematchesAllowed, rng = 0), repeats)
+    else:
+        timings["fixtureDoubleRound"] = timeCall(lambda: fixtureDoubleRound(
+            teams, dict(elos), list(fixtured), requested, antiRequested,
+            rematchesAllowed, rng = 0), repeats)
+
+    teamList = sorted(teams)
+    ratingsMatrix = createGameRatingsMatrix(teamList, elos, fixtured, requested,
+            antiRequested)
+    index = {team:i for i, team in enumerate(teamList)}
+    for backend in backends:
+        pairings = getMaxWeightPairings(ratingsMatrix, teamList, backend)
+        timings["getMaxWeightPairings (%s)" %backend] = dict(timeCall(
+            lambda: getMaxWeightPairings(ratingsMatrix, teamList, backend),
+            repeats), weight=float(sum(ratingsMatrix[index[teamA], index[teamB]]
+                for teamA, teamB in pairings)))
+    return timings
+
+def runBenchmarks(teamCounts: list, seasons: int, requestDensity: float,
+        antiRequestDensity: float, repeats: int, seed: int = 0,
+        backends: list = MATCHING_BACKENDS) -> dict:
+    '''
+    Benchmarks a synthetic league for each team count, returning a report
+    with the settings and, for each function, its timings against the number
+    of teams (the scaling curve)
+    '''
+    curves = {}
+    for teamCount in teamCounts:
+        league = createSyntheticLeague(teamCount, seasons, requestDensity,
+                antiRequestDensity, seed)
+        timings = benchmarkLeague(league, repeats, backends)
+        for function, timing in timings.items():
+            curves.setdefault(function, []).append(dict(teams=teamCount,
+                games=len(league["fixtured"]), **timing))
+    return {"settings":{"teamCounts":teamCounts, "seasons":seasons,
+                "requestDensity":requestDensity,
+                "antiRequestDensity":antiRequestDensity, "repeats":repeats,
+                "seed":seed, "backends":list(backends)},
+            "curves":curves}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fixturing "
+            "hot paths on synthetic leagues, printing the results as JSON")
+    parser.add_argument("--teams", type=int, nargs="+",
+            default=[10, 11, 20, 21, 40, 41, 80, 81],
+            help="the team counts to benchmark (include odd counts to time "
+            "fixtureDoubleRound)")
+    parser.add_argument("--seasons", type=int, default=2,
+            help="seasons of results history per league")
+    parser.add_argument("--request-density", type=float, default=0.02,
+            help="fraction of all possible games that have been requested")
+    parser.add_argument("--anti-request-density", type=float, default=0.02,
+            help="fraction of all possible games that have been anti-requested")
+    parser.add_argument("--repeats", type=int, default=3,
+            help="how many times to time each function")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed for generating the leagues")
+    parser.add_argument("--backends", nargs="+", choices=MATCHING_BACKENDS,
+            default=list(MATCHING_BACKENDS),
+            help="the matching backends to time (default all of them)")
+    parser.add_argument("--output", default=None,
+            help="file to write the JSON report to (default stdout)")
+    args = parser.parse_args()
+
+    report = runBenchmarks(args.teams, args.seasons, args.request_density,
+            args.anti_request_density, args.repeats, args.seed, args.backends)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as outputFile:
+            json.dump(report, outputFile, indent=2)
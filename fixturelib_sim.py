@@ -0,0 +1,257 @@
+# Monte Carlo season projections for the Fixturing Library
+# Usage: python fixturelib_sim.py <config> <division> --rounds 10 > ladder.csv
+from fixturelib import *
+import argparse
+
+
+WIN_POINTS = 2
+DRAW_POINTS = 1
+
+def getLadderPoints(teams, results: pd.DataFrame = None) -> dict:
+    '''
+    Returns the ladder points of each team from a df of results, with
+    WIN_POINTS for a win and DRAW_POINTS for a draw. Teams without results
+    are on zero.
+    '''
+    points = {team:0 for team in teams}
+    if results is None:
+        return points
+    for homeTeam, awayTeam, homeScore, awayScore in zip(results['Home Team'],
+            results['Away Team'], results['Home Score'], results['Away Score']):
+        if homeScore > awayScore:
+            points[homeTeam] += WIN_POINTS
+        elif homeScore < awayScore:
+            points[awayTeam] += WIN_POINTS
+        else:
+            points[homeTeam] += DRAW_POINTS
+            points[awayTeam] += DRAW_POINTS
+    return points
+
+def simulateOutcomes(league: League, points: np.ndarray, schedule: list,
+        simulations: int, seed: int) -> (np.ndarray, np.ndarray):
+    '''
+    Plays out a schedule, a list of rounds of (homeId, awayId) games, in
+    every simulation at once. Elos and points are (simulations x teams)
+    arrays, and each game's winner is drawn from the expected outcome, with
+    the Elos updated as if the winner took every point (like projectElos()).
+    Returns the final (points, elos) arrays.
+    '''
+    rng = np.random.default_rng(seed)
+    elos = np.tile(league.elos, (simulations, 1))
+    points = np.tile(points.astype(float), (simulations, 1))
+    for games in schedule:
+        if not games:
+            continue
+        homeIds, awayIds = np.array(games, dtype=int).T
+        # A double round has teams playing twice, so play it in batches where
+        # no team plays twice, in the order of the fixture
+        batches = getReplayBatches(homeIds, awayIds)
+        for batch in range(batches.max() + 1):
+            home = homeIds[batches == batch]
+            away = awayIds[batches == batch]
+            homeExpected = 1/(1+10**-((elos[:, home] - elos[:, away])/400.0))
+            homeWon = rng.random(homeExpected.shape) < homeExpected
+            homeOutcome = homeWon.astype(float)
+            elos[:, home] += league.kValues[home]*(homeOutcome - homeExpected)
+            elos[:, away] += league.kValues[away]*(homeExpected - homeOutcome)
+            points[:, home] += WIN_POINTS*homeWon
+            points[:, away] += WIN_POINTS*~homeWon
+    return points, elos
+
+def getLadderPositions(points: np.ndarray, elos: np.ndarray) -> np.ndarray:
+    '''
+    Returns the ladder position (0 for first) of each team in each
+    simulation. Teams are ranked on points, with ties broken by Elo.
+    '''
+    # Scale the Elos to less than half a point, so they only break ties
+    tieBreak = elos/(2*np.abs(elos).max() + 1)
+    order = np.argsort(-(points + tieBreak), axis = 1, kind = 'stable')
+    positions = np.empty_like(order)
+    np.put_along_axis(positions, order,
+            np.broadcast_to(np.arange(points.shape[1]), order.shape), axis = 1)
+    return positions
+
+def simulateSchedule(scheduleSeed: int, simulations: int, teams: set,
+        elos: dict, kValues: dict, points: dict, fixtured, requested,
+        antiRequested, rematchesAllowed: int, firstRound: int, roundCount: int,
+        backend: str = "networkx", lookahead: int = 0,
+        doubleRoundMethod: str = "exact", timeLimit: float = 60):
+    '''
+    Fixtures the rest of the season once with fixtureSeason(), seeded with
+    scheduleSeed, and plays it out simulations times. Returns a dict with the
+    count of each team finishing in each position, the total points of each
+    team, and the number of rematches between each pair of teams in the
+    schedule, or None if no schedule could be fixtured.
+    '''
+    try:
+        fixture = fixtureSeason(teams, elos, fixtured, requested, antiRequested,
+                rematchesAllowed, firstRound, roundCount, kValues, backend,
+                scheduleSeed, lookahead, doubleRoundMethod, timeLimit)
+    except FixtureError as error:
+        print("Schedule %i couldn't be fixtured: %s" %(scheduleSeed, error))
+        return None
+
+    league = League(elos, kValues, fixtured)
+    schedule = [league.getIds(zip(roundGames['Home Team'],
+            roundGames['Away Team'])) for roundLabel, roundGames in
+            fixture.groupby('Round', sort = False)]
+
+    # A game is a rematch if the pair has met before, either in the fixtured
+    # games or earlier in this schedule
+    rematches = {}
+    gameCounts = league.gameCounts.copy()
+    for games in schedule:
+        for homeId, awayId in games:
+            if gameCounts[homeId, awayId] > 0:
+                pair = tuple(sorted((league.teams[homeId], league.teams[awayId])))
+                rematches[pair] = rematches.get(pair, 0) + 1
+            gameCounts[homeId, awayId] += 1
+            gameCounts[awayId, homeId] += 1
+
+    startingPoints = np.array([points.get(team, 0) for team in league.teams])
+    finalPoints, finalElos = simulateOutcomes(league, startingPoints, schedule,
+            simulations, scheduleSeed)
+    positions = getLadderPositions(finalPoints, finalElos)
+    teamCount = len(league.teams)
+    positionCounts = np.zeros((teamCount, teamCount), dtype=int)
+    np.add.at(positionCounts, (np.broadcast_to(np.arange(teamCount),
+        positions.shape), positions), 1)
+    return {"teams":league.teams, "positionCounts":positionCounts,
+            "pointsTotal":finalPoints.sum(axis = 0), "rematches":rematches}
+
+def simulateSeason(teams: set, elos: dict, kValues: dict, fixtured, requested,
+        antiRequested, rematchesAllowed: int, firstRound: int, roundCount: int,
+        points: dict = None, simulations: int = 10000, schedules: int = 8,
+        workers: int = None, seed: int = 0, backend: str = "networkx",
+        lookahead: int = 1, doubleRoundMethod: str = "exact",
+        timeLimit: float = 60) -> (pd.DataFrame, pd.DataFrame):
+    '''
+    Projects the rest of a season simulations times, starting from the
+    current Elos and ladder points (see getLadderPoints()).
+    The fixtures for the remaining rounds depend on results that haven't
+    happened yet, so schedules different fixtures are drawn with
+    fixtureSeason() (seeds seed to seed + schedules - 1, each projecting the
+    Elos along its own path), and the simulations are split evenly between
+    them. Within a schedule, every simulation is played out at once with
+    NumPy (see simulateOutcomes()), and the schedules are fixtured and played
+    in their own processes. Pass workers = 1 to run them in this process.
+    Each round of a schedule checks that lookahead more rounds could follow
+    it (see fixtureSingleRoundGames()), so a schedule that runs into a dead
+    end is dropped rather than retried forever.
+    Leagues with an odd number of teams are fixtured in double rounds with
+    fixtureDoubleRound(), and the default "exact" doubleRoundMethod solves a
+    MILP for every double round of every schedule (giving up after timeLimit
+    seconds). That is far slower than fixturing even leagues, so for big odd
+    leagues use the "retry" method or a smaller timeLimit.
+    Returns (ladder, rematchRisk):
+      - ladder: a df indexed by team, with the chance of finishing in each
+        position (columns 1 to n), the expected points and expected position
+      - rematchRisk: a df of the pairs of teams that meet again in any
+        schedule, with the chance they meet again and the expected number of
+        rematches between them
+    Raises a FixtureError if none of the schedules can be fixtured.
+    '''
+    if points is None:
+        points = getLadderPoints(teams)
+    scheduleSeeds = list(range(seed, seed + schedules))
+    simulationCounts = [simulations//schedules + (index < simulations%schedules)
+            for index in range(schedules)]
+    simulate = partial(simulateSchedule, teams = teams, elos = elos,
+            kValues = kValues, points = points, fixtured = fixtured,
+            requested = requested, antiRequested = antiRequested,
+            rematchesAllowed = rematchesAllowed, firstRound = firstRound,
+            roundCount = roundCount, backend = backend, lookahead = lookahead,
+            doubleRoundMethod = doubleRoundMethod, timeLimit = timeLimit)
+
+    if workers == 1:
+        outcomes = list(map(simulate, scheduleSeeds, simulationCounts))
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            outcomes = list(executor.map(simulate, scheduleSeeds,
+                simulationCounts))
+
+    played = [(outcome, count) for outcome, count in
+            zip(outcomes, simulationCounts) if outcome is not None and count]
+    if not played:
+        raise FixtureError("None of the %i schedules could be fixtured"
+                %schedules)
+    if len(played) < len(outcomes):
+        print("Warning: Only %i of %i schedules could be fixtured"
+                %(len(played), len(outcomes)))
+
+    ladderTeams = played[0][0]["teams"]
+    totalSimulations = sum(count for outcome, count in played)
+    positionCounts = sum(outcome["positionCounts"] for outcome, count in played)
+    pointsTotal = sum(outcome["pointsTotal"] for outcome, count in played)
+    ladder = pd.DataFrame(positionCounts/totalSimulations, index = ladderTeams,
+            columns = range(1, len(ladderTeams) + 1))
+    ladder['Expected Points'] = pointsTotal/totalSimulations
+    ladder['Expected Position'] = (positionCounts*np.arange(1,
+        len(ladderTeams) + 1)).sum(axis = 1)/totalSimulations
+    ladder = ladder.sort_values(by='Expected Position', kind='stable')
+
+    rematchRows = {}
+    for outcome, count in played:
+        for pair, rematches in outcome["rematches"].items():
+            chance, expected = rematchRows.get(pair, (0, 0))
+            rematchRows[pair] = (chance + count/totalSimulations,
+                    expected + rematches*count/totalSimulations)
+    rematchRisk = pd.DataFrame([(teamA, teamB, chance, expected) for
+            (teamA, teamB), (chance, expected) in sorted(rematchRows.items())],
+            columns=['Team A', 'Team B', 'Rematch Chance', 'Expected Rematches'])
+    rematchRisk = rematchRisk.sort_values(by='Rematch Chance',
+            ascending=False, kind='stable').reset_index(drop = True)
+    return ladder, rematchRisk
+
+if __name__ == "__main__":
+    import fixturing
+
+    parser = argparse.ArgumentParser(description="Project the rest of a "
+            "division's season, printing the chance of each team finishing in "
+            "each ladder position as CSV")
+    parser.add_argument("config", help="the season config, see fixturing.py")
+    parser.add_argument("division", help="the division to project")
+    parser.add_argument("--rounds", type=int, required=True,
+            help="how many rounds are left in the season")
+    parser.add_argument("--round", type=int, default=None,
+            help="the next round to be played (default the round after the "
+            "last result)")
+    parser.add_argument("--simulations", type=int, default=10000,
+            help="how many times to play out the season")
+    parser.add_argument("--schedules", type=int, default=8,
+            help="how many different fixtures to draw for the remaining rounds")
+    parser.add_argument("--workers", type=int, default=None,
+            help="how many processes to use (1 to run in this process)")
+    parser.add_argument("--seed", type=int, default=0,
+            help="seed for the fixtures and the simulated results")
+    parser.add_argument("--double-round-method", default="exact",
+            choices=DOUBLE_ROUND_METHODS, help="how to fixture double rounds "
+            "for divisions with an odd number of teams (\"retry\" is much "
+            "faster than \"exact\" for big divisions)")
+    parser.add_argument("--time-limit", type=float, default=60,
+            help="seconds the exact double round solver may take per double "
+            "round")
+    parser.add_argument("--rematches", default=None,
+            help="file to write the rematch risk to as CSV")
+    args = parser.parse_args()
+
+    config = parseConfig(args.config)
+    dataSource = getDataSource(config["source"])
+    # Leave the results to be replayed here, as the ladder needs them too
+    loaded = fixturing.loadDivision(dataSource, dict(config, checkpoint = None),
+            args.division, args.round, args.seed)
+    results = loaded["results"]
+    elos = loaded["elos"]
+    if results is not None:
+        elos = updateElosFromResults(dict(elos), results, loaded["kValues"])
+
+    ladder, rematchRisk = simulateSeason(set(elos), elos, loaded["kValues"],
+            loaded["fixtured"], loaded["requested"], loaded["antiRequested"],
+            loaded["rematchesAllowed"], loaded["roundNumber"], args.rounds,
+            getLadderPoints(elos, results), args.simulations, args.schedules,
+            args.workers, args.seed, loaded["backend"],
+            max(loaded["lookahead"], 1), args.double_round_method,
+            args.time_limit)
+    print(ladder.to_csv(), end = "")
+    if args.rematches is not None:
+        rematchRisk.to_csv(path_or_buf=args.rematches, encoding='utf-8')
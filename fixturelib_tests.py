@@ -0,0 +1,748 @@
+# Tests for the Fixturing Library. Run with pytest
+import pytest
+from fixturelib import *
+import fixturelib
+import fixturing
+import fixturelib_sim
+import http.server
+import threading
+
+
+@pytest.fixture(autouse = True)
+def workbookCacheDir(tmp_path, monkeypatch):
+    # Keep the workbook cache out of the home directory, and start each test
+    # like a fresh run
+    cacheDir = str(tmp_path / "workbook cache")
+    monkeypatch.setattr(fixturelib, "WORKBOOK_CACHE_DIR", cacheDir)
+    monkeypatch.setattr(fixturelib, "workbookCache", {})
+    monkeypatch.setattr(fixturelib, "dataSources", {})
+    return cacheDir
+
+def writeTestWorkbook(path, scores: list):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({'Score':scores}).to_excel(writer, sheet_name='Scores',
+                index=False)
+        pd.DataFrame({'TEAM NAME':["A", "B"]}).to_excel(writer,
+                sheet_name='Elos', index=False)
+
+def createRandomResults(teams: list, roundCount: int, seed: int) -> pd.DataFrame:
+    # Random pairings each round, with random scores that are never 0-0
+    rng = np.random.default_rng(seed)
+    rows = []
+    for roundNumber in range(1, roundCount + 1):
+        order = rng.permutation(teams)
+        for i in range(0, len(order), 2):
+            rows.append((roundNumber, order[i], order[i+1],
+                int(rng.integers(0, 20)), int(rng.integers(1, 20))))
+    return pd.DataFrame(rows, columns=RESULTS_COLUMNS)
+
+def countCalls(monkeypatch, module, name: str) -> list:
+    # Wraps module.name to record each call, returning the list of calls
+    calls = []
+    function = getattr(module, name)
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+    monkeypatch.setattr(module, name, counted)
+    return calls
+
+def test_gameHistoryCountsUnorderedPairs():
+    history = GameHistory(["A vs B", "B vs A", "A vs C"])
+    assert history.count("A", "B") == 2
+    assert history.count("B", "A") == 2
+    assert history.count("C", "A") == 1
+    assert history.count("B", "C") == 0
+    assert history.count("A", "Unknown Team") == 0
+
+    history.addGames(["C vs B"])
+    assert history.count("B", "C") == 1
+
+def test_checkIfGameInListMatchesHistory():
+    games = ["A vs B", "B vs A", "A vs C"]
+    assert checkIfGameInList("A", "B", games) == (True, 2)
+    assert checkIfGameInList("B", "C", games) == (False, 0)
+    assert checkIfGameInList("A", "B", GameHistory(games)) == (True, 2)
+
+def test_createGameRatingsMatrixMatchesCreateGameRating():
+    elos = {"A": 1000, "B": 1100, "C": 950, "D": 1000}
+    fixtured = ["A vs B", "B vs A", "C vs D"]
+    requested = ["A vs C"]
+    antiRequested = ["D vs B"]
+    teams = list(elos.keys())
+    gameRatings = createGameRatingsMatrix(teams, elos, fixtured, requested,
+            antiRequested)
+    for i, teamA in enumerate(teams):
+        for j, teamB in enumerate(teams):
+            if teamA != teamB:
+                expected = createGameRating(teamA, teamB, elos, fixtured,
+                        requested, antiRequested)
+                assert abs(gameRatings[i, j] - expected) < 1e-9
+
+def test_matchingBackendsGiveSameTotalWeight():
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(3)
+    for teamCount in (8, 13, 20):
+        teams = ["Team %i" % i for i in range(teamCount)]
+        gameRatings = rng.uniform(80, 110, size=(teamCount, teamCount))
+        gameRatings = np.triu(gameRatings, 1) + np.triu(gameRatings, 1).T
+        index = {team:i for i, team in enumerate(teams)}
+
+        totals = []
+        for backend in MATCHING_BACKENDS:
+            pairings = getMaxWeightPairings(gameRatings, teams, backend)
+            totals.append(sum(gameRatings[index[a], index[b]] for a, b in pairings))
+        assert totals[0] == pytest.approx(totals[1])
+
+def test_matchingBackendsPairUpZeroRatedTeams():
+    pytest.importorskip("scipy")
+    # Only A vs B is worth anything, but C and D should still play
+    teams = ["A", "B", "C", "D", "E"]
+    gameRatings = np.zeros((5, 5))
+    gameRatings[0, 1] = gameRatings[1, 0] = 100
+    for backend in MATCHING_BACKENDS:
+        pairings = getMaxWeightPairings(gameRatings, teams, backend)
+        assert len(pairings) == 2
+        assert ("A", "B") in pairings
+
+        # A sparse graph pairs up as many teams as its edges allow
+        fixtureGraph = nx.Graph()
+        fixtureGraph.add_nodes_from(teams)
+        fixtureGraph.add_weighted_edges_from([("A", "B", 100), ("B", "C", 0),
+            ("C", "D", 0), ("A", "E", 0)])
+        pairings = getMaxWeightPairings(fixtureGraph, backend = backend)
+        assert sorted(tuple(sorted(pairing)) for pairing in pairings) == \
+                [("A", "B"), ("C", "D")]
+
+def test_matchingBackendsOnlyUseGraphEdges():
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(8)
+    for trial in range(10):
+        teams = ["Team %i" % i for i in range(12)]
+        elos = {team:rng.uniform(900, 1300) for team in teams}
+        fixtured = ["%s vs %s" % tuple(rng.choice(teams, 2, replace = False))
+                for game in range(20)]
+        fixtureGraph = createGameRatingsGraph(fixtured, [], [], elos, topK = 2)
+
+        totals = []
+        for backend in MATCHING_BACKENDS:
+            pairings = getMaxWeightPairings(fixtureGraph, backend = backend)
+            assert all(fixtureGraph.has_edge(a, b) for a, b in pairings)
+            totals.append(sum(fixtureGraph[a][b]['weight'] for a, b in pairings))
+        assert totals[0] == pytest.approx(totals[1])
+
+def test_replayElosMatchesGameByGameUpdates():
+    teams = ["Team %i" % i for i in range(6)]
+    games = createRandomResults(teams, 4, 5).to_dict('records')
+    # Shuffle the rows and give them non-positional labels, as getResults does
+    results = pd.DataFrame(games).sample(frac=1, random_state=1)
+    startingElos = {team:1000 + 10*i for i, team in enumerate(teams)}
+    kValues = {team:32 for team in teams}
+
+    expected = dict(startingElos)
+    for game in games:
+        homeTeam, awayTeam = game['Home Team'], game['Away Team']
+        homePerc, awayPerc = getGameOutcome(game['Home Score'], game['Away Score'])
+        homeExp, awayExp = getExpectedOutcome(expected[homeTeam], expected[awayTeam])
+        homeNew = getDeviation(homeExp, homePerc, expected[homeTeam], 32)
+        awayNew = getDeviation(awayExp, awayPerc, expected[awayTeam], 32)
+        if game['Home Score'] > game['Away Score']:
+            homeNew = max(expected[homeTeam], homeNew)
+        if game['Home Score'] < game['Away Score']:
+            awayNew = max(expected[awayTeam], awayNew)
+        expected[homeTeam], expected[awayTeam] = homeNew, awayNew
+
+    elos, trajectory = replayElos(dict(startingElos), results, kValues,
+            returnTrajectory = True)
+    for team in teams:
+        assert elos[team] == pytest.approx(expected[team])
+        assert trajectory.loc[4, team] == pytest.approx(expected[team])
+    assert list(trajectory.index) == [1, 2, 3, 4]
+
+def test_replayElosDrawsNilAllAndSkipsUnplayedGames():
+    teams = ["A", "B", "C", "D"]
+    startingElos = {"A":950, "B":1050, "C":1000, "D":1000}
+    kValues = {team:32 for team in teams}
+    results = createRandomResults(teams, 2, 4)
+    expected = replayElos(dict(startingElos), results, kValues)
+
+    # A 0-0 game is a draw, so the lower rated team gains
+    nilAll = pd.DataFrame([(3, "A", "B", 0, 0)], columns=RESULTS_COLUMNS)
+    elos = replayElos(dict(expected), nilAll, kValues)
+    homeExpected, awayExpected = getExpectedOutcome(expected["A"], expected["B"])
+    assert elos["A"] == pytest.approx(getDeviation(homeExpected, 0.5,
+        expected["A"], 32))
+    assert elos["B"] == pytest.approx(getDeviation(awayExpected, 0.5,
+        expected["B"], 32))
+
+    # Rows without scores haven't been played, and don't move any Elos
+    unplayed = pd.concat([results, pd.DataFrame([(3, "A", "B", np.nan, np.nan),
+        (3, "C", "D", 4, np.nan)], columns=RESULTS_COLUMNS)], ignore_index=True)
+    assert replayElos(dict(startingElos), unplayed, kValues) == \
+            pytest.approx(expected)
+
+    # Every team that plays needs a K value
+    with pytest.raises(KeyError):
+        replayElos(dict(startingElos), results, {"A":32, "B":32})
+
+def test_eloCheckpointReplaysOnlyNewResults(tmp_path, monkeypatch):
+    teams = ["Team %i" % i for i in range(6)]
+    results = createRandomResults(teams, 6, 6)
+    prefix = results.iloc[:9]
+    startingElos = {team:1000 + 10*i for i, team in enumerate(teams)}
+    kValues = {team:32 for team in teams}
+    checkpointPath = str(tmp_path / "checkpoint.json")
+
+    def replayAll(elos, results, kValues):
+        return updateElosFromResults(dict(elos), results, kValues)
+    replayed = countCalls(monkeypatch, fixturelib, "replayElos")
+    def checkpointed(elos, results, kValues):
+        replayed.clear()
+        updated = updateElosWithCheckpoint(dict(elos), results, kValues,
+                checkpointPath)
+        # The number of results replayed to get there
+        return updated, len(replayed[0][1].index)
+
+    assert checkpointed(startingElos, prefix, kValues) == (pytest.approx(
+        replayAll(startingElos, prefix, kValues)), 9)
+
+    # Results appended since the checkpoint are the only ones replayed
+    assert checkpointed(startingElos, results, kValues) == (pytest.approx(
+        replayAll(startingElos, results, kValues)), 9)
+    assert checkpointed(startingElos, results, kValues)[1] == 0
+
+    # Editing a checkpointed result, or the starting Elos or K values, means
+    # replaying everything
+    edited = results.copy()
+    edited.loc[2, 'Home Score'] += 5
+    assert checkpointed(startingElos, edited, kValues) == (pytest.approx(
+        replayAll(startingElos, edited, kValues)), 18)
+    changedElos = dict(startingElos, **{"Team 0":1100})
+    assert checkpointed(changedElos, edited, kValues) == (pytest.approx(
+        replayAll(changedElos, edited, kValues)), 18)
+    changedKValues = dict(kValues, **{"Team 3":40})
+    assert checkpointed(changedElos, edited, changedKValues) == (pytest.approx(
+        replayAll(changedElos, edited, changedKValues)), 18)
+
+def test_homeGameCountsWithPrefixTeamNames():
+    games = ["Red vs Blue", "Red Devils vs Red", "Blue vs Red Devils"]
+    teams = {"Red", "Red Devils", "Blue"}
+    assert getHomeGameCounts(teams, games) == {"Red":1, "Red Devils":1, "Blue":1}
+    assert getAwayGameCounts(teams, games) == {"Red":1, "Red Devils":1, "Blue":1}
+
+def test_fixtureDivisionsFixturesEveryTeam():
+    divisions = {}
+    for name, teamCount in (("Even", 6), ("Odd", 5)):
+        teams = ["%s %i" % (name, i) for i in range(teamCount)]
+        divisions[name] = {"elos":{team:1000 + 25*i for i, team in enumerate(teams)},
+                "kValues":{team:32 for team in teams},
+                "fixtured":["%s vs %s" % (teams[0], teams[1])],
+                "roundNumber":1}
+
+    instrumentation.reset()
+    fixtures = fixtureDivisions(divisions, workers = 2)
+    assert set(fixtures.keys()) == {"Even", "Odd"}
+    # The worker processes' timings are merged into this process
+    report = instrumentation.report()
+    assert report["stages"]["matching"]["calls"] >= 1
+    assert report["counters"]["edgesEvaluated"] >= 15
+    for name, division in divisions.items():
+        fixture = fixtures[name]
+        teamsPlaying = set(fixture['Home Team']) | set(fixture['Away Team'])
+        assert teamsPlaying == set(division["elos"].keys())
+
+def test_fixtureDoubleRoundExact():
+    pytest.importorskip("scipy")
+    teams = ["Team %i" % i for i in range(7)]
+    elos = {team:1000 + 30*i for i, team in enumerate(teams)}
+    fixtured = ["Team 0 vs Team 1", "Team 2 vs Team 3", "Team 4 vs Team 5",
+            "Team 6 vs Team 0"]
+
+    games = fixtureDoubleRoundExact(set(teams), elos, fixtured, [], [], 0)
+    history = GameHistory(fixtured)
+    pairs = [frozenset(game) for game in games]
+    assert len(games) == len(teams)
+    assert len(set(pairs)) == len(pairs)
+    assert all(history.count(homeTeam, awayTeam) == 0 for homeTeam, awayTeam in games)
+    for team in teams:
+        assert sum(team in game for game in games) == 2
+    # Each round has everyone but one team, and the bye teams play each other
+    playingRd1 = {team for game in games[:3] for team in game}
+    playingRd2 = {team for game in games[3:6] for team in game}
+    assert set(games[6]) == (set(teams) - playingRd1) | (set(teams) - playingRd2)
+
+def test_fixtureDoubleRoundExactReportsImpossibleFixture():
+    pytest.importorskip("scipy")
+    elos = {"A":1000, "B":1000, "C":1000}
+    with pytest.raises(FixtureError):
+        fixtureDoubleRound(set(elos), elos, ["A vs B", "B vs C", "C vs A"],
+                [], [], 0)
+
+def test_searchFixturesIsReproducibleFromSeed():
+    teams = ["Team %i" % i for i in range(8)]
+    elos = {team:1000 + 20*i for i, team in enumerate(teams)}
+    fixtured = ["Team 0 vs Team 1", "Team 2 vs Team 3", "Team 4 vs Team 5"]
+
+    fixture, seed = searchFixtures(attemptSingleRound, set(teams), elos,
+            fixtured, [], [], 0, attempts = 4, workers = 2, pick = "best")
+    games, totalRating, valid = attemptSingleRound(seed, set(teams), elos,
+            fixtured, [], [], 0)
+    assert valid
+    assert list(zip(fixture['Home Team'], fixture['Away Team'])) == games
+
+def test_seededFixturesAreReproducible():
+    for teamCount in (8, 7):
+        teams = ["Team %i" % i for i in range(teamCount)]
+        elos = {team:1000 + 15*i for i, team in enumerate(teams)}
+        kValues = {team:32 for team in teams}
+        fixtures = [fixtureSeason(set(teams), elos, [], [], [], 0, 1, 4,
+            kValues = kValues, rng = 42) for run in range(2)]
+        assert fixtures[0].equals(fixtures[1])
+
+    fixtures = [fixtureDoubleRound(set(teams), dict(elos), [], [], [], 0,
+        method = "retry", rng = 7) for run in range(2)]
+    assert fixtures[0].equals(fixtures[1])
+
+def test_fixtureSeasonCarriesHistoryBetweenRounds():
+    teams = ["Team %i" % i for i in range(8)]
+    elos = {team:1000 + 25*i for i, team in enumerate(teams)}
+    fixtured = ["Team 0 vs Team 1", "Team 2 vs Team 3"]
+    fixture = fixtureSeason(set(teams), elos, fixtured, [], [], 0, 1, 5, rng = 3)
+    assert fixtured == ["Team 0 vs Team 1", "Team 2 vs Team 3"]
+
+    # Every team plays once a round, and no pair meets twice across the block
+    # or again after the fixtured games
+    for roundLabel, roundGames in fixture.groupby('Round'):
+        roundTeams = list(roundGames['Home Team']) + list(roundGames['Away Team'])
+        assert sorted(roundTeams) == sorted(teams)
+    pairs = [frozenset(pair) for pair in zip(fixture['Home Team'],
+        fixture['Away Team'])]
+    assert len(set(pairs)) == len(pairs) == 20
+    assert not {frozenset(("Team 0", "Team 1")), frozenset(("Team 2",
+        "Team 3"))} & set(pairs)
+
+    # The home games of earlier rounds are counted when picking the home team
+    homeCounts = getHomeGameCounts(teams, fixtured + list(fixture['Game Code']))
+    assert max(homeCounts.values()) - min(homeCounts.values()) <= 1
+
+def test_fixtureSeasonLabelsOddLeagueDoubleRounds():
+    teams = ["Team %i" % i for i in range(5)]
+    elos = {team:1000 + 25*i for i, team in enumerate(teams)}
+    fixture = fixtureSeason(set(teams), elos, [], [], [], 0, 1, 4, rng = 1)
+    assert list(fixture['Round'].unique()) == ["1-2", "3-4"]
+    for roundLabel, roundGames in fixture.groupby('Round'):
+        assert len(roundGames.index) == len(teams)
+    # The driver names the output file after the same rounds
+    assert fixturing.getRoundLabel({"roundNumber":1, "roundCount":4},
+            len(teams)) == "1-4"
+
+    # Double rounds can't cover an odd number of rounds, or start on an even one
+    for firstRound, roundCount in ((1, 3), (2, 4)):
+        with pytest.raises(ValueError):
+            fixtureSeason(set(teams), elos, [], [], [], 0, firstRound,
+                    roundCount, rng = 1)
+
+def test_historyCountsAreCachedForGameLists(monkeypatch):
+    monkeypatch.setattr(fixturelib, "historyCache", fixturelib.OrderedDict())
+    monkeypatch.setattr(fixturelib, "HISTORY_CACHE_SIZE", 4)
+    elos = {"A":1000, "B":1100, "C":950, "D":1000}
+    fixtured = ["A vs B", "C vs D", "B vs A"]
+    instrumentation.reset()
+    first = League(elos, None, fixtured, ["A vs C"], [])
+    second = League(elos, None, fixtured, ["A vs C"], [])
+    counters = instrumentation.report()["counters"]
+    assert (counters["historyCacheMisses"], counters["historyCacheHits"]) == (3, 3)
+    assert (second.gameCounts == GameHistory(fixtured).getCountMatrix(
+        second.teams)).all()
+    assert list(second.homeCounts) == [1, 1, 1, 0]
+
+    # Leagues built from the cache don't share their arrays
+    first.addGames([(0, 2)])
+    assert second.gameCounts[0, 2] == 0 and second.homeCounts[0] == 1
+    assert League(elos, None, fixtured).gameCounts[0, 2] == 0
+
+    # A GameHistory may change later, so it isn't cached
+    def getCacheCounts():
+        counters = instrumentation.report()["counters"]
+        return (counters["historyCacheMisses"], counters["historyCacheHits"])
+    before = getCacheCounts()
+    League(elos, None, GameHistory(fixtured), GameHistory([]), GameHistory([]))
+    assert getCacheCounts() == before
+    for games in range(10):
+        League(elos, None, ["A vs B"]*games)
+    assert len(fixturelib.historyCache) == 4
+
+def test_candidatePairingsPairEveryTeam():
+    rng = np.random.default_rng(11)
+    teams = ["Team %i" % i for i in range(30)]
+    gameRatings = rng.uniform(80, 110, size=(30, 30))
+    gameRatings = np.triu(gameRatings, 1) + np.triu(gameRatings, 1).T
+    graph = createCandidateGraph(gameRatings, teams, 3)
+    assert graph.number_of_edges() <= 30*3
+
+    pairings = getCandidatePairings(gameRatings, teams, 3)
+    assert len(pairings) == 15
+    assert {team for pairing in pairings for team in pairing} == set(teams)
+
+def test_instrumentationRecordsStagesAndCounters():
+    instrumentation.reset()
+    stagesSeen = []
+    instrumentation.callback = lambda stageName, seconds: stagesSeen.append(stageName)
+    try:
+        teams = ["Team %i" % i for i in range(6)]
+        elos = {team:1000 + 10*i for i, team in enumerate(teams)}
+        fixtureSingleRound(set(teams), elos, [], [], [], 0, rng = 1)
+    finally:
+        instrumentation.callback = None
+    report = instrumentation.report()
+    assert report["stages"]["graph build"]["calls"] >= 1
+    assert report["stages"]["matching"]["calls"] >= 1
+    assert "matching" in stagesSeen
+    assert report["counters"]["edgesEvaluated"] >= 15
+
+def test_loadWorkbookDownloadsAndParsesOncePerRun(tmp_path, workbookCacheDir,
+        monkeypatch):
+    pytest.importorskip("openpyxl")
+    workbookPath = str(tmp_path / "league.xlsx")
+    writeTestWorkbook(workbookPath, [1, 2])
+    parses = countCalls(monkeypatch, pd, "read_excel")
+    downloads = countCalls(monkeypatch, fixturelib, "fetchWorkbookData")
+
+    tables = loadWorkbook(workbookPath, ['Scores', 'Elos'])
+    assert list(tables['Scores']['Score']) == [1, 2]
+    assert getDataFromRemote(workbookPath, 'Elos').equals(tables['Elos'])
+    assert len(parses) == len(downloads) == 1
+
+    # A new run on the unchanged workbook reads it, but skips the parse
+    fixturelib.workbookCache.clear()
+    assert list(loadWorkbook(workbookPath, ['Scores'])['Scores']['Score']) == [1, 2]
+    assert len(downloads) == 2 and len(parses) == 1
+
+    # An edited workbook is parsed again, and replaces the old one on disk
+    writeTestWorkbook(workbookPath, [3, 4])
+    fixturelib.workbookCache.clear()
+    assert list(loadWorkbook(workbookPath, ['Scores'])['Scores']['Score']) == [3, 4]
+    assert len(parses) == 2
+    cached = sorted(os.path.splitext(name)[1] for name in
+            os.listdir(workbookCacheDir))
+    assert cached == [".json", ".pkl", ".xlsx"]
+
+    # Only the most recently used workbooks are kept
+    monkeypatch.setattr(fixturelib, "WORKBOOK_CACHE_ENTRIES", 1)
+    otherPath = str(tmp_path / "other.xlsx")
+    writeTestWorkbook(otherPath, [5])
+    loadWorkbook(otherPath, ['Scores'])
+    assert len(os.listdir(workbookCacheDir)) == 3
+    assert list(fixturelib.readWorkbookCacheIndex(workbookCacheDir)) == \
+            [os.path.abspath(otherPath)]
+
+def test_loadWorkbookRevalidatesRemoteWorkbookWithETag(tmp_path,
+        workbookCacheDir, monkeypatch):
+    pytest.importorskip("openpyxl")
+    workbookPath = str(tmp_path / "league.xlsx")
+    served = {"etag":'"v1"', "requests":[]}
+
+    class WorkbookHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            served["requests"].append(self.headers.get("If-None-Match"))
+            if self.headers.get("If-None-Match") == served["etag"]:
+                self.send_response(304)
+                self.end_headers()
+                return
+            with open(workbookPath, 'rb') as workbookFile:
+                data = workbookFile.read()
+            self.send_response(200)
+            self.send_header("ETag", served["etag"])
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), WorkbookHandler)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    try:
+        URL = "http://127.0.0.1:%i/league.xlsx" % server.server_port
+        writeTestWorkbook(workbookPath, [1, 2])
+        parses = countCalls(monkeypatch, pd, "read_excel")
+        assert list(loadWorkbook(URL, ['Scores'])['Scores']['Score']) == [1, 2]
+        assert served["requests"] == [None] and len(parses) == 1
+
+        # The next run sends the ETag back, gets a 304 and uses the cache
+        fixturelib.workbookCache.clear()
+        assert list(loadWorkbook(URL, ['Scores'])['Scores']['Score']) == [1, 2]
+        assert served["requests"] == [None, '"v1"'] and len(parses) == 1
+
+        # Once the workbook changes it is downloaded and parsed again
+        writeTestWorkbook(workbookPath, [3])
+        served["etag"] = '"v2"'
+        fixturelib.workbookCache.clear()
+        assert list(loadWorkbook(URL, ['Scores'])['Scores']['Score']) == [3]
+        assert served["requests"] == [None, '"v1"', '"v1"'] and len(parses) == 2
+        assert fixturelib.readWorkbookCacheIndex(workbookCacheDir)[URL]["etag"] \
+                == '"v2"'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@pytest.mark.parametrize("snapshotFormat", SNAPSHOT_FORMATS)
+def test_snapshotSourceRoundTripsWorkbook(tmp_path, snapshotFormat):
+    pytest.importorskip("openpyxl")
+    pytest.importorskip("pyarrow")
+    workbookPath = str(tmp_path / "league.xlsx")
+    with pd.ExcelWriter(workbookPath) as writer:
+        pd.DataFrame({'Round':[2, 1, 1], 'Home Team':["A", "B", "A"],
+            'Away Team':["B", "C", "C"], 'Home Score':[10, 4, 7],
+            'Away Score':[3, 4, 9]}).to_excel(writer, sheet_name='Mixed-Scores',
+                index=False)
+        pd.DataFrame({'TEAM NAME':["A", "B", "C"], 'STARTING ELO':[1000, 1050, 990],
+            'K Value':[32, 32, 40]}).to_excel(writer,
+                sheet_name='Mixed-Starting Elos', index=False)
+
+    snapshot = writeSnapshot(workbookPath, str(tmp_path / "snapshot"),
+            snapshotFormat = snapshotFormat)
+    assert isinstance(getDataSource(str(tmp_path / "snapshot")), SnapshotSource)
+    for table in ('Mixed-Scores', 'Mixed-Starting Elos'):
+        assert getDataFromRemote(snapshot, table).equals(
+                getDataFromRemote(workbookPath, table))
+    assert list(getResults(snapshot, 'Mixed-Scores')['Round']) == [1, 1, 2]
+    assert getRatings(snapshot, 'Mixed-Starting Elos', 'TEAM NAME',
+            'STARTING ELO', 'K Value') == getRatings(workbookPath,
+            'Mixed-Starting Elos', 'TEAM NAME', 'STARTING ELO', 'K Value')
+
+def test_headlessDriverFixturesEachDivision(tmp_path, capsys):
+    pytest.importorskip("openpyxl")
+    workbookPath = str(tmp_path / "league.xlsx")
+    with pd.ExcelWriter(workbookPath) as writer:
+        for name, teamCount in (("Even", 6), ("Odd", 5)):
+            teams = ["%s %i" % (name, i) for i in range(teamCount)]
+            pd.DataFrame({'TEAM NAME':teams, 'STARTING ELO':[1000]*teamCount,
+                'K Value':[32]*teamCount}).to_excel(writer,
+                    sheet_name=name + '-Elos', index=False)
+            pd.DataFrame({'Round':[1, 1], 'Home Team':teams[0:2],
+                'Away Team':teams[2:4], 'Home Score':[10, 5],
+                'Away Score':[3, 8]}).to_excel(writer,
+                    sheet_name=name + '-Scores', index=False)
+    config = {"season":"Test", "source":workbookPath, "roundNumber":3,
+            "checkpoint":str(tmp_path / "{division} Checkpoint {season}.json"),
+            "divisions":{name:{"results":name + "-Scores", "ratings":name + "-Elos"}
+                for name in ("Even", "Odd")}}
+    configPath = tmp_path / "config.json"
+    configPath.write_text(json.dumps(config))
+
+    assert fixturing.main([str(configPath), "--output-dir", str(tmp_path),
+        "--workers", "1", "--seed", "1"]) == 0
+    assert (tmp_path / "Even Round 3 Fixtures Test.csv").exists()
+    assert (tmp_path / "Odd Round 3-4 Fixtures Test.csv").exists()
+    assert (tmp_path / "Even Checkpoint Test.json").exists()
+    assert fixturing.main([str(tmp_path / "missing.json")]) == 1
+
+    # Timings cover the work done in the worker processes
+    capsys.readouterr()
+    assert fixturing.main([str(configPath), "--output-dir", str(tmp_path),
+        "--workers", "2", "--seed", "1", "--timings"]) == 0
+    output = capsys.readouterr().out
+    report = json.loads(output[output.index("\n{") + 1:])
+    for stageName in ("graph build", "matching"):
+        assert report["stages"][stageName]["calls"] >= 1
+
+def test_retryPenaltySteersAwayFromRematches(monkeypatch):
+    # A vs B is a rematch, but with the cross games anti-requested, A vs B and
+    # C vs D is still the best rated round
+    elos = {team:1000 for team in ("A", "B", "C", "D")}
+    antiRequested = ["A vs C", "A vs D", "B vs C", "B vs D"]
+    league = League(elos, None, ["A vs B"], [], antiRequested)
+    gameRatings = combineRatingsMatrices(league.getHistoryRatings(),
+            getEloRatings(league.elos))
+    assert getMaxWeightPairings(gameRatings, [0, 1, 2, 3]) == [(0, 1), (2, 3)]
+
+    instrumentation.reset()
+    games = fixtureLeagueRound(league, 0, rng = 1)
+    assert sorted(teamId for game in games for teamId in game) == [0, 1, 2, 3]
+    assert all(league.gameCounts[idA, idB] == 0 for idA, idB in games)
+    assert instrumentation.report()["counters"]["retries"] >= 1
+
+    # Each retry takes retryPenalty off the rematch, on top of the small
+    # change from altering the Elos
+    for retryPenalty in (10, 0):
+        ratings = []
+        def recordRatings(gameRatings, teams = None, backend = "networkx"):
+            ratings.append(gameRatings[0][1]['weight'])
+            return [(0, 1), (2, 3)] if len(ratings) == 1 else [(0, 2), (1, 3)]
+        monkeypatch.setattr(fixturelib, "getMaxWeightPairings", recordRatings)
+        league = League(elos, None, ["A vs B"], [], antiRequested)
+        fixtureLeagueRound(league, 0, retryPenalty = retryPenalty, rng = 1)
+        assert len(ratings) == 2
+        assert ratings[1] == pytest.approx(ratings[0] - retryPenalty, abs = 0.1)
+        assert ratings[1] != ratings[0]
+        assert list(league.elos) != [1000]*4
+
+def test_lookaheadAvoidsDeadEndRounds():
+    # Without lookahead, the greedy rounds of this season leave no valid
+    # matching a few rounds in, and the retries never finish
+    rng = random.Random(1)
+    teams = ["Team %02i" % i for i in range(12)]
+    elos = {team:rng.gauss(1000, 150) for team in teams}
+    fixtured = []
+    for roundNumber in range(5):
+        order = list(teams)
+        rng.shuffle(order)
+        fixtured += [order[i] + " vs " + order[i+1] for i in range(0, 12, 2)]
+
+    fixture = fixtureSeason(set(teams), elos, fixtured, [], [], 0, 1, 6,
+            kValues = {team:32 for team in teams}, rng = 1, lookahead = 5)
+    history = GameHistory(fixtured)
+    history.addGames(fixture['Game Code'])
+    assert len(fixture) == 36
+    assert all(history.count(*parseGameCode(gameCode)) == 1
+            for gameCode in fixture['Game Code'])
+
+def test_lookaheadReportsImpossibleRound():
+    teams = ["A", "B", "C", "D"]
+    with pytest.raises(FixtureError):
+        fixtureSingleRound(set(teams), {team:1000 for team in teams},
+                ["A vs B", "A vs C", "A vs D"], [], [], 0, lookahead = 1)
+
+def test_leagueMatchesGameHistory():
+    elos = {"C":1000, "A":1100, "B":950}
+    fixtured = ["A vs B", "C vs A", "A vs B"]
+    league = League(elos, {"A":32, "B":32, "C":16}, fixtured, ["B vs C"], [])
+    assert league.teams == ["A", "B", "C"]
+    assert league.getNames(league.getIds([("C", "B")])) == [("C", "B")]
+    assert league.gameCounts[0, 1] == 2 and league.gameCounts[2, 0] == 1
+    assert list(league.homeCounts) == [2, 0, 1]
+    gameRatings = combineRatingsMatrices(league.getHistoryRatings(),
+            getEloRatings(league.elos))
+    assert np.allclose(gameRatings, createGameRatingsMatrix(league.teams, elos,
+        fixtured, ["B vs C"], []))
+
+    league.addGames(league.getIds([("B", "C")]))
+    history = league.getGameHistory()
+    assert history.count("B", "C") == 1 and history.count("A", "B") == 2
+    assert history.homeCounts == {"A":2, "B":1, "C":1}
+
+def test_leagueProjectsDoubleRoundsGameByGame(monkeypatch):
+    # Every team plays twice, so the games can't all be updated at once
+    teams = ["A", "B", "C"]
+    kValues = {team:32 for team in teams}
+    games = [("A", "B"), ("B", "C"), ("C", "A")]
+    for seed in range(5):
+        league = League({team:1000 for team in teams}, kValues)
+        league.projectElos(league.getIds(games), seed)
+        expected = projectElos({team:1000 for team in teams}, games, kValues, seed)
+        assert league.getEloDict() == pytest.approx(expected)
+
+    # With equal K values a season's projections move Elo between teams, but
+    # never change the total, even in the double rounds of an odd league
+    teams = ["Team %i" % i for i in range(7)]
+    elos = {team:1000 + 30*i for i, team in enumerate(teams)}
+    doubleRounds = countCalls(monkeypatch, fixturelib, "fixtureDoubleRound")
+    fixtureSeason(set(teams), elos, [], [], [], 0, 1, 6,
+            kValues = {team:32 for team in teams}, rng = 2)
+    projected = [call[1] for call in doubleRounds]
+    assert len(projected) == 3
+    assert projected[0] == pytest.approx(elos)
+    for roundElos in projected[1:]:
+        assert roundElos != pytest.approx(elos)
+        assert sum(roundElos.values()) == pytest.approx(sum(elos.values()))
+
+def test_gameHistoryRollsBackStagedGames():
+    history = GameHistory(["A vs B"])
+    history.begin()
+    history.addGames(["A vs B", "C vs A"])
+    assert history.count("A", "B") == 2
+    history.rollback()
+    assert history.count("A", "B") == 1 and history.count("A", "C") == 0
+    assert history.homeCounts == {"A":1} and history.awayCounts == {"B":1}
+
+    history.begin()
+    history.addGame("C", "B")
+    history.commit()
+    assert history.count("B", "C") == 1
+
+def test_fixtureDoubleRoundRetryLeavesHistoryUnchanged():
+    teams = ["Team %i" % i for i in range(7)]
+    elos = {team:1000 + 30*i for i, team in enumerate(teams)}
+    fixtured = ["Team 0 vs Team 1", "Team 2 vs Team 3", "Team 4 vs Team 5",
+            "Team 6 vs Team 0", "Team 1 vs Team 2", "Team 3 vs Team 4"]
+    fixturedList = list(fixtured)
+    history = GameHistory(fixtured)
+    for games in (fixturedList, history):
+        fixture = fixtureDoubleRound(set(teams), dict(elos), games, [], [], 0,
+                method = "retry", rng = 3)
+        assert len(fixture) == 7
+    assert fixturedList == fixtured
+    assert history.pairCounts == GameHistory(fixtured).pairCounts
+    assert history.homeCounts == GameHistory(fixtured).homeCounts
+
+@pytest.mark.parametrize("fileType", ["csv", "parquet", "feather"])
+def test_streamedResultsMatchWholeReplay(tmp_path, fileType):
+    if fileType != "csv":
+        pytest.importorskip("pyarrow")
+    teams = ["Team %i" % i for i in range(10)]
+    results = createRandomResults(teams, 30, 9)
+    # Swap two games within a round, which streaming should put back in order
+    results.iloc[[5, 3]] = results.iloc[[3, 5]].to_numpy()
+    path = str(tmp_path / ("results." + fileType))
+    if fileType == "csv":
+        results.to_csv(path, index=False)
+    elif fileType == "parquet":
+        results.to_parquet(path)
+    else:
+        results.to_feather(path)
+
+    startingElos = {team:1000 + 5*i for i, team in enumerate(teams)}
+    kValues = {team:32 for team in teams}
+    chunks = list(iterResultChunks(path, chunkSize = 7))
+    assert all(chunks[i]['Round'].max() < chunks[i+1]['Round'].min()
+            for i in range(len(chunks) - 1))
+    streamed = updateElosFromStream(dict(startingElos),
+            iterResultChunks(path, chunkSize = 7), kValues)
+    expected = updateElosFromResults(dict(startingElos), results, kValues)
+    assert streamed == pytest.approx(expected)
+
+def test_streamedResultsMustBeInRoundOrder(tmp_path):
+    path = str(tmp_path / "results.csv")
+    pd.DataFrame([(roundNumber, "A", "B", 1, 0) for roundNumber in
+        (1, 1, 2, 2, 3, 1)], columns=RESULTS_COLUMNS).to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        list(iterResultChunks(path, chunkSize = 2))
+
+def test_simulateSeasonGivesLadderDistributions():
+    teams = ["Team %i" % i for i in range(6)]
+    elos = {team:900 + 50*i for i, team in enumerate(teams)}
+    kValues = {team:32 for team in teams}
+    points = {team:0 for team in teams}
+    points["Team 0"] = 20
+
+    runs = [fixturelib_sim.simulateSeason(set(teams), elos, kValues, [], [], [],
+        1, 1, 8, points, simulations = 2000, schedules = 3, workers = 1, seed = 4)
+        for run in range(2)]
+    ladder, rematchRisk = runs[0]
+    assert ladder.equals(runs[1][0])
+    positions = ladder[list(range(1, 7))]
+    assert np.allclose(positions.sum(axis = 1), 1)
+    assert np.allclose(positions.sum(axis = 0), 1)
+    # Team 0 can't be caught in 8 rounds
+    assert ladder.loc["Team 0", 1] == 1
+    assert ladder.loc["Team 5", 'Expected Points'] > ladder.loc["Team 1", 'Expected Points']
+    # 8 rounds is more than a round robin, so some pairs must meet again
+    assert (rematchRisk['Rematch Chance'] == 1).any()
+
+def test_simulateSeasonPassesDoubleRoundMethodThrough(monkeypatch):
+    teams = ["Team %i" % i for i in range(7)]
+    elos = {team:900 + 50*i for i, team in enumerate(teams)}
+    kValues = {team:32 for team in teams}
+    exactCalls = countCalls(monkeypatch, fixturelib, "fixtureDoubleRoundExact")
+
+    ladder, rematchRisk = fixturelib_sim.simulateSeason(set(teams), elos,
+            kValues, [], [], [], 1, 1, 4, simulations = 200, schedules = 2,
+            workers = 1, doubleRoundMethod = "retry")
+    assert exactCalls == []
+    assert np.allclose(ladder[list(range(1, 8))].sum(axis = 1), 1)
+
+    fixturelib_sim.simulateSeason(set(teams), elos, kValues, [], [], [], 1, 1,
+            4, simulations = 200, schedules = 2, workers = 1, timeLimit = 5)
+    assert len(exactCalls) == 4
+    assert all(call[-1] == 5 for call in exactCalls)
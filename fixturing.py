@@ -0,0 +1,167 @@
+# Fixtures the next round of every division in a season, as set out in a JSON
+# config (see fixturing_2018b.json), without asking for any input
+# Usage: python fixturing.py <config> [<config> ...] [--round N]
+import argparse
+import json
+import os
+import sys
+
+
+COLUMN_DEFAULTS = {"teamName":"TEAM NAME", "elo":"STARTING ELO",
+        "kValue":"K Value", "gameCode":"Game Code"}
+
+def getDivisionTables(division: dict) -> list:
+    '''
+    Returns the names of all the tables a division reads from the data source
+    '''
+    return [division[key] for key in ("results", "ratings", "fixtured",
+            "requested", "antiRequested") if division.get(key) is not None]
+
+def getNextRound(results) -> int:
+    '''
+    Returns the round after the last one with results, for when a config
+    doesn't give the round to fixture
+    '''
+    rounds = results['Round'].map(lambda roundNumber:
+            str(roundNumber).split("-")[-1])
+    rounds = [int(float(roundNumber)) for roundNumber in rounds
+            if roundNumber.replace(".", "", 1).isdigit()]
+    return max(rounds, default = 0) + 1
+
+def loadDivision(dataSource, config: dict, name: str, roundNumber: int,
+        seed) -> dict:
+    '''
+    Loads the tables for one division of a config and returns the division
+    config that fixturelib.fixtureDivision() takes. If the config has a
+    checkpoint pattern, the Elos are replayed here with
+    updateElosWithCheckpoint(), otherwise the results are passed on to be
+    replayed by fixtureDivision().
+    '''
+    import fixturelib
+    division = config["divisions"][name]
+    columns = dict(COLUMN_DEFAULTS, **config.get("columns", {}))
+    elos, kValues, teams = fixturelib.getRatings(dataSource, division["ratings"],
+            columns["teamName"], columns["elo"], columns["kValue"])
+
+    def getGameCodes(key):
+        if division.get(key) is None:
+            return []
+        return list(fixturelib.getDataFromRemote(dataSource,
+            division[key])[columns["gameCode"]])
+
+    loaded = {"elos":elos, "kValues":kValues,
+            "fixtured":getGameCodes("fixtured"),
+            "requested":getGameCodes("requested"),
+            "antiRequested":getGameCodes("antiRequested"),
+            "rematchesAllowed":division.get("rematchesAllowed",
+                config.get("rematchesAllowed", 0)),
+            "roundCount":config.get("roundCount", 1),
+            "backend":config.get("backend", "networkx"),
+            "seed":seed,
+            "topK":config.get("topK"),
+            "lookahead":config.get("lookahead", 0)}
+
+    results = None
+    if division.get("results") is not None:
+        results = fixturelib.getResults(dataSource, division["results"])
+    loaded["roundNumber"] = roundNumber
+    if roundNumber is None:
+        loaded["roundNumber"] = 1 if results is None else getNextRound(results)
+
+    if results is not None and config.get("checkpoint") is not None:
+        checkpointPath = config["checkpoint"].format(division = name,
+                season = config["season"])
+        loaded["elos"] = fixturelib.updateElosWithCheckpoint(elos, results,
+                kValues, checkpointPath)
+    else:
+        loaded["results"] = results
+    return loaded
+
+def getRoundLabel(division: dict, teamCount: int) -> str:
+    '''
+    Returns the rounds a division's fixture covers, as used in the output file
+    name, e.g. "5" or "5-6"
+    '''
+    roundNumber = division["roundNumber"]
+    if division["roundCount"] > 1:
+        return "%i-%i" %(roundNumber, roundNumber + division["roundCount"] - 1)
+    if teamCount%2 == 1:
+        return "%i-%i" %(roundNumber, roundNumber + 1)
+    return str(roundNumber)
+
+def runSeason(config: dict, roundNumber: int = None, seed = None,
+        workers: int = None, outputDir: str = None) -> list:
+    '''
+    Fixtures every division in a season config, writing each fixture to a
+    CSV. Returns the paths written.
+    '''
+    import fixturelib
+    season = config["season"]
+    seed = config.get("seed") if seed is None else seed
+    roundNumber = config.get("roundNumber") if roundNumber is None else roundNumber
+    outputDir = config.get("outputDir", ".") if outputDir is None else outputDir
+    output = config.get("output", "{division} Round {round} Fixtures {season}.csv")
+
+    print("Loading %s data from %s" %(season, config["source"]))
+    dataSource = fixturelib.getDataSource(config["source"])
+    dataSource.loadTables([table for division in config["divisions"].values()
+            for table in getDivisionTables(division)])
+    divisions = {name:loadDivision(dataSource, config, name,
+            roundNumber, seed) for name in config["divisions"]}
+
+    print("Fixturing %s divisions: %s" %(season, ", ".join(divisions)))
+    fixtures = fixturelib.fixtureDivisions(divisions, workers)
+    paths = []
+    for name, fixture in fixtures.items():
+        division = divisions[name]
+        if fixture is None:
+            print("%s round %i was fixtured with the round before it"
+                    %(name, division["roundNumber"]))
+            continue
+        roundLabel = getRoundLabel(division, len(division["elos"]))
+        path = os.path.join(outputDir, output.format(division = name,
+            round = roundLabel, season = season))
+        fixture.to_csv(path_or_buf=path, encoding='utf-8')
+        print("Wrote %s round %s to %s" %(name, roundLabel, path))
+        paths.append(path)
+    return paths
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Fixture the next round of "
+            "every division in one or more seasons, as set out in JSON configs")
+    parser.add_argument("configs", nargs="+",
+            help="the season configs to run, one after the other")
+    parser.add_argument("--round", type=int, default=None,
+            help="the round to fixture (default the config's roundNumber, or "
+            "the round after the last result)")
+    parser.add_argument("--seed", type=int, default=None,
+            help="seed for the random choices (default the config's seed)")
+    parser.add_argument("--workers", type=int, default=None,
+            help="how many processes to fixture divisions in (1 to run them in "
+            "this process)")
+    parser.add_argument("--output-dir", default=None,
+            help="the directory to write fixtures to (default the config's "
+            "outputDir, or the current directory)")
+    parser.add_argument("--timings", action="store_true",
+            help="print the time spent in each stage of the run as JSON")
+    args = parser.parse_args(argv)
+
+    # Only pay for pandas and networkx once there's work to do
+    import fixturelib
+    fixturelib.instrumentation.reset()
+
+    failed = []
+    for configPath in args.configs:
+        try:
+            runSeason(fixturelib.parseConfig(configPath), args.round,
+                    args.seed, args.workers, args.output_dir)
+        except (fixturelib.FixtureError, KeyError, OSError, ValueError) as error:
+            print("Failed to fixture %s: %s" %(configPath, error),
+                    file = sys.stderr)
+            failed.append(configPath)
+    if args.timings:
+        print(json.dumps(fixturelib.instrumentation.report(), indent = 2))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,55 @@
 from fixturelib import *
+import argparse
 
 
 rootURL = 'https://docs.google.com/spreadsheets/d/10KrdFgNjH-L0NxBmXEl60beEEIgdtTzBElKM0k2Q3S8/export?format=xlsx&id=10KrdFgNjH-L0NxBmXEl60beEEIgdtTzBElKM0k2Q3S8'
 season = "2018b"
 
-print("Enter Round Number")
-roundNumber=int(input())
+parser = argparse.ArgumentParser(description="Fixture the %s season" %season)
+parser.add_argument("round", type=int, nargs="?",
+        help="the first round to fixture (asked for if not given)")
+parser.add_argument("--rounds", type=int, default=1,
+        help="how many rounds to fixture in one go (default 1)")
+parser.add_argument("--seed", type=int, default=None,
+        help="seed for the random choices, so a run can be repeated exactly")
+parser.add_argument("--source", default=rootURL,
+        help="where to read the league data from: the workbook URL (default), "
+        "a local workbook or a snapshot made by fixturing_snapshot.py")
+parser.add_argument("--timings", action="store_true",
+        help="print the time spent in each stage of the run as JSON")
+args = parser.parse_args()
+
+def printTimings():
+    if args.timings:
+        print(json.dumps(instrumentation.report(), indent=2))
+
+if args.round is None:
+    print("Enter Round Number")
+    roundNumber=int(input())
+else:
+    roundNumber=args.round
 
 print("Retrieving Results from remote")
-mixedResults = getResults(URL=rootURL, table='Mixed-Scores')
-ladiesResults = getResults(URL=rootURL, table='Ladies-Scores')
+# Load every table we need in one pass, so a workbook is only downloaded once
+dataSource = getDataSource(args.source)
+dataSource.loadTables(tables=['Mixed-Scores', 'Ladies-Scores',
+        'Ladies-Starting Elos', 'Mixed-Starting Elos', 'Ladies-Fixtured Games',
+        'Mixed-Fixtured Games', 'Mixed-Requests', 'Ladies-Requests',
+        'Mixed-Antirequests'])
+mixedResults = getResults(URL=dataSource, table='Mixed-Scores')
+ladiesResults = getResults(URL=dataSource, table='Ladies-Scores')
 
 # Grab the rating data and unpack it
-ladiesRatings = getRatings(URL=rootURL, table='Ladies-Starting Elos', teamNameCol='TEAM NAME', teamEloCol='STARTING ELO', teamKCol='K Value')
-mixedRatings = getRatings(URL=rootURL, table='Mixed-Starting Elos', teamNameCol='TEAM NAME',teamEloCol='STARTING ELO', teamKCol='K Value')
+ladiesRatings = getRatings(URL=dataSource, table='Ladies-Starting Elos', teamNameCol='TEAM NAME', teamEloCol='STARTING ELO', teamKCol='K Value')
+mixedRatings = getRatings(URL=dataSource, table='Mixed-Starting Elos', teamNameCol='TEAM NAME',teamEloCol='STARTING ELO', teamKCol='K Value')
 
-ladiesFixtured = list(getDataFromRemote(URL=rootURL, table='Ladies-Fixtured Games')['Game Code'])
-mixedFixtured = list(getDataFromRemote(URL=rootURL, table='Mixed-Fixtured Games')['Game Code'])
-mixedRequested = list(getDataFromRemote(URL=rootURL, table='Mixed-Requests')['Game Code'])
-ladiesRequested = list(getDataFromRemote(URL=rootURL, table='Ladies-Requests')['Game Code'])
+ladiesFixtured = list(getDataFromRemote(URL=dataSource, table='Ladies-Fixtured Games')['Game Code'])
+mixedFixtured = list(getDataFromRemote(URL=dataSource, table='Mixed-Fixtured Games')['Game Code'])
+mixedRequested = list(getDataFromRemote(URL=dataSource, table='Mixed-Requests')['Game Code'])
+ladiesRequested = list(getDataFromRemote(URL=dataSource, table='Ladies-Requests')['Game Code'])
 # Init these as empty lists
 ladiesAntiRequested = list()
-mixedAntiRequested = list(getDataFromRemote(URL=rootURL,table='Mixed-Antirequests')['Game Code'])
+mixedAntiRequested = list(getDataFromRemote(URL=dataSource,table='Mixed-Antirequests')['Game Code'])
 print("Successfully retrieved Results from Remote")
 
 mixedStartingElos = mixedRatings[0]
@@ -33,10 +61,11 @@ ladiesTeams = ladiesRatings[2]
 
 # Process the results to update the Elos
 print("Parsing results to update Ratings")
-ladiesElos = updateElosFromResults(elos=ladiesStartingElos,results=ladiesResults,
-        kValues=ladiesKVals)
-mixedElos = updateElosFromResults(elos=mixedStartingElos,results=mixedResults,
-        kValues=mixedKVals)
+# Only results added since the last run are replayed, see updateElosWithCheckpoint
+ladiesElos = updateElosWithCheckpoint(elos=ladiesStartingElos,results=ladiesResults,
+        kValues=ladiesKVals, checkpointPath="Ladies Elo Checkpoint %s.json" %season)
+mixedElos = updateElosWithCheckpoint(elos=mixedStartingElos,results=mixedResults,
+        kValues=mixedKVals, checkpointPath="Mixed Elo Checkpoint %s.json" %season)
 print("Successfully parsed results to update Ratings\nFinding Game Ratings")
 # Create the Game Ratings Graph
 mixedGameRatings = createGameRatingsGraph(fixturedGames=mixedFixtured,
@@ -50,29 +79,53 @@ print("Successfully found Game Ratings")
 mixedFixture = None
 ladiesFixture = None
 
+if args.rounds > 1:
+    # Fixture a block of rounds, feeding each round into the next
+    lastRound = roundNumber + args.rounds - 1
+    print("Fixturing Ladies Teams, Rounds %i-%i" %(roundNumber, lastRound))
+    ladiesFixture = fixtureSeason(teams=ladiesTeams, elos=ladiesElos,
+            fixtured=ladiesFixtured, requested=ladiesRequested,
+            antiRequested=ladiesAntiRequested, rematchesAllowed=0,
+            firstRound=roundNumber, roundCount=args.rounds, kValues=ladiesKVals,
+            rng=args.seed)
+    print("Ladies Fixture Complete.\nFixturing Mixed Teams")
+    mixedFixture = fixtureSeason(teams=mixedTeams, elos=mixedElos,
+            fixtured=mixedFixtured, requested=mixedRequested,
+            antiRequested=mixedAntiRequested, rematchesAllowed=0,
+            firstRound=roundNumber, roundCount=args.rounds, kValues=mixedKVals,
+            rng=args.seed)
+    print("Mixed Fixture Complete.\nWriting to CSV")
+    mixedPath = "Mixed Rounds %i-%i Fixtures %s.csv" %(roundNumber, lastRound, season)
+    mixedFixture.to_csv(path_or_buf=mixedPath,encoding='utf-8')
+    ladiesPath = "Ladies Rounds %i-%i Fixtures %s.csv" %(roundNumber, lastRound, season)
+    ladiesFixture.to_csv(path_or_buf=ladiesPath,encoding='utf-8')
+    print("Script Complete.")
+    printTimings()
+    raise SystemExit
+
 print("Fixturing Ladies Teams")
 if len(ladiesTeams)%2 == 0:
     ladiesRoundNumber = str(roundNumber)
     ladiesFixture = fixtureSingleRound(teams=ladiesTeams, elos=ladiesElos,
             fixtured=ladiesFixtured, requested=ladiesRequested,
-            antiRequested=ladiesAntiRequested,rematchesAllowed=0)
+            antiRequested=ladiesAntiRequested,rematchesAllowed=0, rng=args.seed)
 elif len(ladiesTeams)%2 == 1 and roundNumber%2 == 1:
     ladiesRoundNumber = "%i-%i" %(roundNumber,roundNumber+1)
     ladiesFixture = fixtureDoubleRound(teams=ladiesTeams, elos=ladiesElos,
             fixtured=ladiesFixtured, requested=ladiesRequested,
-            antiRequested=ladiesAntiRequested,rematchesAllowed=0)
+            antiRequested=ladiesAntiRequested,rematchesAllowed=0, rng=args.seed)
 
 print("Ladies Fixture Complete.\nFixturing Mixed Teams")
 if len(mixedTeams)%2 == 0:
     mixedRoundNumber = str(roundNumber)
     mixedFixture = fixtureSingleRound(teams=mixedTeams, elos=mixedElos,
             fixtured=mixedFixtured, requested=mixedRequested,
-            antiRequested=mixedAntiRequested,rematchesAllowed=0)
+            antiRequested=mixedAntiRequested,rematchesAllowed=0, rng=args.seed)
 elif len(mixedTeams)%2 == 1 and roundNumber%2 == 1:
     mixedRoundNumber = "%i-%i" %(roundNumber, roundNumber+1)
     mixedFixture = fixtureDoubleRound(teams=mixedTeams, elos=mixedElos,
             fixtured=mixedFixtured, requested=mixedRequested,
-            antiRequested=mixedAntiRequested,rematchesAllowed=0)
+            antiRequested=mixedAntiRequested,rematchesAllowed=0, rng=args.seed)
 print("Mixed Fixture Complete.\nWriting to CSV")
 if mixedFixture is not None:
     mixedPath = "Mixed Round %s Fixtures %s.csv" %(mixedRoundNumber, season)
@@ -82,4 +135,4 @@ if ladiesFixture is not None:
     ladiesPath = "Ladies Round %s Fixtures %s.csv" %(ladiesRoundNumber, season)
     ladiesFixture.to_csv(path_or_buf=ladiesPath,encoding='utf-8')
 print("Script Complete.")
-
+printTimings()
@@ -0,0 +1,21 @@
+# Converts a league workbook into a Parquet/Feather snapshot, so fixturing
+# runs can load it quickly and without network access
+# Usage: python fixturing_snapshot.py <workbook URL or path> <snapshot dir>
+from fixturelib import *
+import argparse
+
+
+parser = argparse.ArgumentParser(description="Convert a league workbook into "
+        "a snapshot directory that can be passed anywhere a workbook URL is")
+parser.add_argument("source",
+        help="the workbook URL or path (or another snapshot) to convert")
+parser.add_argument("path", help="the directory to write the snapshot to")
+parser.add_argument("--tables", nargs="+", default=None,
+        help="the tables to convert (default every table)")
+parser.add_argument("--format", choices=SNAPSHOT_FORMATS, default="parquet",
+        help="the file format of the snapshot (default parquet)")
+args = parser.parse_args()
+
+print("Loading tables from %s" %args.source)
+snapshot = writeSnapshot(args.source, args.path, args.tables, args.format)
+print("Wrote %i tables to %s" %(len(snapshot.files), args.path))